@@ -0,0 +1,224 @@
+# ##### BEGIN GPL LICENCE BLOCK #####
+#  Copyright (C) 2025  Arthur Langlard
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENCE BLOCK #####
+
+
+# Headless benchmarks of etp.py on synthetic images and sessions.
+#
+#   python bench.py --output results.json
+#   python bench.py --baseline results.json --threshold 0.2
+#
+# The second form exits with an error if a benchmark is more than 20 % slower
+# than in the baseline.
+
+
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import argparse
+import json
+import math
+import platform
+import statistics
+import tempfile
+import time
+import numpy
+import pygame
+import etp
+
+
+IMAGE_MEGAPIXELS = [1, 10, 100]
+SESSION_POINTS = [10, 1000, 100000, 1000000]
+ZOOM_FACTORS = [0.25, 1.0, 4.0]
+WINDOW_SIZE = (1000, 1000)
+NOISE_FLOOR = 0.0005    # Slowdowns shorter than this, in seconds, are not reported.
+
+
+def make_image(megapixels):
+    """Return a surface of a synthetic 4:3 graph: grid, axes and a curve."""
+    width = int(math.sqrt(megapixels * 1e6 * 4 / 3))
+    height = width * 3 // 4
+    image = pygame.Surface((width, height))
+    image.fill("white")
+    pixels = pygame.surfarray.pixels3d(image)
+    pixels[::100, :] = (200, 200, 200)
+    pixels[:, ::100] = (200, 200, 200)
+    pixels[50, :] = (0, 0, 0)
+    pixels[:, height - 50] = (0, 0, 0)
+    columns = numpy.arange(width)
+    rows = (height / 2 + height / 3 * numpy.sin(columns * 6 / width)).astype(int)
+    pixels[columns, rows] = (0, 0, 255)
+    del pixels
+    return image
+
+
+def make_session(points, image_size, series_count=20):
+    """Return a session of random points over an image, in several series."""
+    chest = etp.new_session()
+    data_gcoord, axes_gcoord = chest[0], chest[1]
+    rng = numpy.random.default_rng(0)
+    width, height = image_size
+    gcoords = rng.random((points, 2)) * (width, height)
+    data_gcoord[0].extend(gcoords[:max(1, points // series_count)])
+    for series_points in numpy.array_split(gcoords[max(1, points // series_count):], series_count - 1):
+        etp.apply_edit(chest, (etp.operation.add_series, 0, etp.marker.circle, 5.0, 0.0))
+        data_gcoord[-1].extend(series_points)
+    axes_gcoord[:] = [[(50, height - 50), (width - 50, height - 50)], [(50, height - 50), (50, 50)]]
+    return chest
+
+
+def timed(function, repeat):
+    """Run a function repeat times. Return the median and the minimum durations."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {"median": statistics.median(durations), "min": min(durations), "repeat": repeat}
+
+
+def make_renderer(screen, image, chest, zoom_factor):
+    """Return a renderer drawing the scene of the window, image, axes and markers, as the window does,
+    and a function panning the view by 8 pixels and drawing the frame."""
+    scene = etp.PlotScene(etp.ScaledImageCache(image), etp.MarkerSprites(), chest)
+    view = [(image.get_width() / 2 - WINDOW_SIZE[0] / 2 / zoom_factor,
+             image.get_height() / 2 - WINDOW_SIZE[1] / 2 / zoom_factor)]
+    alphas = etp.PlotScene.alphas(len(chest[0]))
+    renderer = etp.DirtyRenderer(screen, lambda surface: scene.draw(surface, zoom_factor, view[0]), lambda surface: None,
+                                 prepare_scene=lambda rects: scene.prepare(rects, alphas, zoom_factor, view[0], WINDOW_SIZE))
+
+    def pan():
+        view[0] = (view[0][0] + 8 / zoom_factor, view[0][1])
+        frame(renderer)
+
+    return renderer, pan
+
+
+def frame(renderer):
+    """Redraw the whole window."""
+    renderer.damage()
+    renderer.render()
+
+
+def bench_render(results, screen, image, chest, name, repeat):
+    """Time the first frame, which scales the image and draws the layers of the series,
+    the next ones at each zoom level, and pans."""
+    for zoom_factor in ZOOM_FACTORS:
+        renderer, pan = make_renderer(screen, image, chest, zoom_factor)
+        results[name + "/zoom-%g/first" % zoom_factor] = timed(lambda: frame(renderer), 1)
+        results[name + "/zoom-%g" % zoom_factor] = timed(lambda: frame(renderer), repeat)
+        results[name + "/zoom-%g/pan" % zoom_factor] = timed(pan, repeat)
+
+
+def bench_session(results, chest, points, directory, repeat):
+    """Time the computation, export, saving and loading of a session."""
+    data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size, _ = chest
+    filename = os.path.join(directory, "bench-%d.png" % points)
+    name = "session/points-%d" % points
+
+    data_coord = etp.compute_coords(data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size)
+    results[name + "/compute"] = timed(lambda: etp.compute_coords(data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size), repeat)
+    results[name + "/export"] = timed(lambda: etp.export_data(filename, data_coord), repeat)
+    results[name + "/save"] = timed(lambda: etp.save_session(filename, chest), repeat)
+
+    def load():
+        (data_gcoord, *_), journal = etp.load_session(filename)
+        journal.close()
+        return sum(float(series_gcoord.points.sum()) for series_gcoord in data_gcoord)    # Read the mapped points.
+    results[name + "/load"] = timed(load, repeat)
+
+
+def run_benchmarks(image_megapixels, session_points, repeat):
+    """Run all the benchmarks and return their results by name."""
+    etp.load_pygame()
+    pygame.init()
+    screen = pygame.display.set_mode(WINDOW_SIZE)
+    results = {}
+
+    small_image = None
+    for megapixels in image_megapixels:
+        image = make_image(megapixels)
+        chest = make_session(10000, image.get_size())
+        bench_render(results, screen, image, chest, "render/image-%gMP" % megapixels, repeat)
+        if small_image is None:
+            small_image = image
+        print("images of %g MP done" % megapixels)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for points in session_points:
+            chest = make_session(points, small_image.get_size(), min(20, points))
+            bench_render(results, screen, small_image, chest, "render/points-%d" % points, repeat)
+            bench_session(results, chest, points, directory, repeat)
+            print("sessions of %d points done" % points)
+
+    pygame.quit()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the ratio of each median to the baseline. Return the names of the benchmarks slower than 1 + threshold."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print("%-45s %10.3f ms   (new)" % (name, result["median"] * 1000))
+            continue
+        ratio = result["median"] / max(baseline[name]["median"], 1e-9)
+        flag = ""
+        if ratio > 1 + threshold and result["median"] - baseline[name]["median"] > NOISE_FLOOR:
+            regressions.append(name)
+            flag = "   SLOWER"
+        print("%-45s %10.3f ms   %10.3f ms   x%.2f%s" % (name, baseline[name]["median"] * 1000, result["median"] * 1000, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks of etp.py")
+    parser.add_argument('--quick', action='store_true',
+                        help="Only images up to 10 MP and sessions up to 100000 points")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="Number of runs of each benchmark, the median is kept (default: 5)")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="Compare the results to this JSON file of earlier results")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Slowdown relative to the baseline reported as a regression (default: 0.2)")
+    args = parser.parse_args()
+
+    image_megapixels = [megapixels for megapixels in IMAGE_MEGAPIXELS if not args.quick or megapixels <= 10]
+    session_points = [points for points in SESSION_POINTS if not args.quick or points <= 100000]
+    results = run_benchmarks(image_megapixels, session_points, args.repeat)
+
+    report = {"machine": {"platform": platform.platform(), "python": platform.python_version(),
+                          "numpy": numpy.__version__, "pygame": pygame.version.ver},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        print("%d benchmarks, %d slower than the baseline by more than %d %%" % (len(results), len(regressions), args.threshold * 100))
+        return 1 if regressions else 0
+
+    for name, result in results.items():
+        print("%-45s %10.3f ms" % (name, result["median"] * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -21,15 +21,30 @@
 # Last modification: 15-06-2025
 
 
+import time
+START_TIME = time.perf_counter()    # Start of the import of this module, for the startup report.
+
 import argparse
-import pygame
-import pygame.freetype
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
+import struct
 import pickle
 import os
+import shutil
+import math
+import threading
+from collections import OrderedDict, deque
 from enum import Enum, auto, IntEnum
 import numpy
 
 
+pygame = None   # Imported by load_pygame() when a window is opened, sessions do not need it.
+
+
 
 class mode(Enum):
     normal = auto()
@@ -40,6 +55,12 @@ class axis_type(Enum):
     x = auto()
     y = auto()
 
+class axis_scale(Enum):
+    linear = auto()
+    log = auto()
+    linear_reversed = auto()
+    log_reversed = auto()
+
 class marker(IntEnum):
     circle = auto()
     square = auto()
@@ -47,29 +68,2237 @@ class marker(IntEnum):
     triangle = auto()
     triangle_inverted = auto()
 
+class operation(IntEnum):
+    append_point = auto()       # series, x, y
+    pop_point = auto()          # series, index
+    move_point = auto()         # series, index, dx, dy
+    translate_series = auto()   # series, dx, dy
+    add_series = auto()         # index: marker shape, x: marker size
+    delete_series = auto()      # series
+    set_marker_size = auto()    # series, x: size
+    set_marker_shape = auto()   # series, index: shape
+    set_axis_point = auto()     # series: axis, index: start or end, x, y
+    set_axis_scale = auto()     # series: axis, index: scale
+    set_axis_value = auto()     # series: axis, index: start or end, x: value
+    insert_point = auto()       # series, index, x, y
+    insert_series = auto()      # series, index: marker shape, x: marker size
+
 class QuitEvent(Exception):
     pass
 
 
-def analyze_picture(filename):
-    """The whole analysis for one image"""
+class SpatialGrid:
+    """Uniform grid over the points of a series, to find the points in a region or near a position.
+
+    The indices of the points are sorted by cell of cell_size x cell_size global
+    coordinates, and each occupied cell keeps the range of its indices in that
+    order. The grid follows the edits that do not renumber the points: a translation
+    of the whole series is kept as an offset, and the points appended or moved since
+    the grid was built are kept apart and always tested. The positions of the
+    candidates are tested exactly, so points that left their cell are never reported.
+    """
+
+    def __init__(self, points=(), cell_size=32.0):
+        self.cell_size = cell_size
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+        self.size = len(points)
+        self.offset = numpy.zeros(2)    # Translation of the points since the grid was built.
+        self.extra = set()              # Indices of the points appended or moved since the grid was built.
+        cells = numpy.floor(points / cell_size).astype(numpy.int64)
+        shifted = cells - cells.min(axis=0) if len(cells) else cells
+        keys = shifted[:, 1] * (shifted[:, 0].max(initial=0) + 1) + shifted[:, 0]   # One sort key per cell, row after row.
+        self.order = numpy.argsort(keys)
+        sorted_keys = keys[self.order]
+        new_cell = numpy.ones(len(sorted_keys), dtype=bool)
+        new_cell[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        self.starts = numpy.flatnonzero(new_cell)
+        self.ends = numpy.append(self.starts[1:], len(sorted_keys))
+        self.cells = cells[self.order[self.starts]]     # (column, row) of the occupied cells.
+
+
+    def moved(self, index):
+        """Follow a point appended or moved."""
+        self.extra.add(index)
+
+
+    def translate(self, dx, dy):
+        """Follow a translation of all the points."""
+        self.offset += (dx, dy)
+
+
+    def stale(self):
+        """Return True if so many points were appended or moved that the grid is better built again."""
+        return len(self.extra) > max(1024, self.size // 4)
+
+
+    def candidates(self, selected, length):
+        """Return the indices of the points of the selected cells and of the points kept apart, below length."""
+        selected = numpy.flatnonzero(selected)
+        counts = self.ends[selected] - self.starts[selected]
+        positions = numpy.arange(counts.sum()) + numpy.repeat(self.starts[selected] - (numpy.cumsum(counts) - counts), counts)
+        indices = self.order[positions]
+        if self.extra:
+            indices = numpy.unique(numpy.concatenate((indices, numpy.fromiter(self.extra, dtype=numpy.int64, count=len(self.extra)))))
+        else:
+            indices.sort()
+        return indices[:numpy.searchsorted(indices, length)]
 
-    pygame.init()
-    screen = pygame.display.set_mode((1000, 1000), pygame.RESIZABLE | pygame.HWSURFACE | pygame.DOUBLEBUF)
-    pygame.display.set_caption("Exhume This Plot")
-    clock = pygame.time.Clock()
-    running = True
-    dt = 0
 
-    asurf = pygame.image.load(filename)
+    def query(self, gcoord_min, gcoord_max, points):
+        """Return the sorted indices of the points inside a rectangle."""
+        cell_min = numpy.floor((numpy.asarray(gcoord_min) - self.offset) / self.cell_size)
+        cell_max = numpy.floor((numpy.asarray(gcoord_max) - self.offset) / self.cell_size)
+        selected = (self.cells >= cell_min).all(axis=1) & (self.cells <= cell_max).all(axis=1)
+        indices = self.candidates(selected, len(points))
+        candidates = points[indices]
+        return indices[(candidates >= gcoord_min).all(axis=1) & (candidates <= gcoord_max).all(axis=1)]
+
+
+    def nearest(self, gcoord, points):
+        """Return the index of the point closest to a position, or None if there is no point."""
+        if not len(points):
+            return None
+        # Lower bound of the distance to the points of each cell, the distance to the cell.
+        low = self.cells * self.cell_size + self.offset
+        gap = numpy.maximum(numpy.maximum(low - gcoord, numpy.asarray(gcoord) - (low + self.cell_size)), 0.0)
+        bounds = numpy.hypot(gap[:, 0], gap[:, 1])
+
+        def closest(selected):
+            indices = self.candidates(selected, len(points))
+            if not len(indices):
+                return None, math.inf
+            distances = numpy.hypot(points[indices, 0] - gcoord[0], points[indices, 1] - gcoord[1])
+            best = numpy.argmin(distances)
+            return int(indices[best]), distances[best]
+
+        first = numpy.zeros(len(bounds), dtype=bool)
+        if len(bounds):
+            first[numpy.argmin(bounds)] = True
+        _, best_distance = closest(first)   # A first distance to bound the search.
+        best_index, _ = closest(bounds <= best_distance)
+        return best_index
+
+
+
+class Series:
+    """Growable array of the global coordinates of the points of one data series.
+
+    The points are stored in a contiguous (capacity, 2) float64 buffer that
+    doubles when full. `points` is a view on the used part of the buffer, so it
+    can be handed to the drawing, computing and saving code without copying.
+    The spatial grid of the points is built on first use, then kept up to date
+    by the appends, moves and translations, and built again on the next use
+    after the edits that renumber the points.
+    version is increased by every edit, to tell when a drawing of the series is outdated.
+    """
+
+    def __init__(self, gcoords=(), copy=True):
+        gcoords = numpy.asarray(gcoords, dtype=numpy.float64).reshape(-1, 2)
+        self.length = len(gcoords)
+        if copy:
+            self.buffer = numpy.empty((max(16, self.length), 2))
+            self.buffer[:self.length] = gcoords
+        else:   # Read-only buffers, such as memory-mapped files, are copied on the first change.
+            self.buffer = gcoords
+        self._grid = None
+        self.version = 0
+
+
+    @property
+    def grid(self):
+        """Return the spatial grid of the points, built again if the edits made it stale."""
+        if self._grid is None or self._grid.stale():
+            self._grid = SpatialGrid(self.points)
+        return self._grid
+
+
+    @property
+    def points(self):
+        """Return a (n, 2) view on the points of the series."""
+        return self.buffer[:self.length]
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __iter__(self):
+        return iter(map(tuple, self.points.tolist()))
+
+
+    def __getitem__(self, index):
+        return tuple(self.points[index].tolist())
+
+
+    def __setitem__(self, index, gcoord):
+        index = range(self.length)[index]
+        self.reserve(self.length)
+        self.points[index] = gcoord
+        self.version += 1
+        if self._grid is not None:
+            self._grid.moved(index)
+
+
+    def reserve(self, capacity):
+        """Make room for at least capacity points, in a writable buffer."""
+        if capacity > len(self.buffer) or not self.buffer.flags.writeable:
+            buffer = numpy.empty((max(16, capacity, 2 * len(self.buffer)), 2))
+            buffer[:self.length] = self.points
+            self.buffer = buffer
+
+
+    def append(self, gcoord):
+        """Add a point at the end of the series."""
+        self.reserve(self.length + 1)
+        self.buffer[self.length] = gcoord
+        self.length += 1
+        self.version += 1
+        if self._grid is not None:
+            self._grid.moved(self.length - 1)
+
+
+    def extend(self, gcoords):
+        """Add several points at the end of the series."""
+        gcoords = numpy.asarray(gcoords, dtype=numpy.float64).reshape(-1, 2)
+        self.reserve(self.length + len(gcoords))
+        self.buffer[self.length:self.length + len(gcoords)] = gcoords
+        self.length += len(gcoords)
+        self.version += 1
+        self._grid = None
+
+
+    def pop(self, index=-1):
+        """Remove a point and return it."""
+        gcoord = self[index]
+        index = range(self.length)[index]
+        self.reserve(self.length)
+        self.buffer[index:self.length - 1] = self.buffer[index + 1:self.length]
+        self.length -= 1
+        self.version += 1
+        if index < self.length:    # The points after it are renumbered, the grid is built again when used.
+            self._grid = None
+        return gcoord
+
+
+    def insert(self, index, gcoord):
+        """Add a point before the point at index."""
+        self.reserve(self.length + 1)
+        self.buffer[index + 1:self.length + 1] = self.buffer[index:self.length]
+        self.buffer[index] = gcoord
+        self.length += 1
+        self.version += 1
+        if self._grid is not None:
+            if index == self.length - 1:
+                self._grid.moved(index)
+            else:   # The points after it are renumbered, the grid is built again when used.
+                self._grid = None
+
+
+    def move(self, index, dx, dy):
+        """Move one point."""
+        x_gcoord, y_gcoord = self[index]
+        self[index] = (x_gcoord + dx, y_gcoord + dy)
+
+
+    def translate(self, dx, dy):
+        """Move all the points of the series."""
+        self.reserve(self.length)
+        self.points[:] += (dx, dy)
+        self.version += 1
+        if self._grid is not None:
+            self._grid.translate(dx, dy)
+
+
+    def visible(self, gcoord_min, gcoord_max):
+        """Return the points inside a rectangle, or all of them if it contains the whole series."""
+        return self.points[self.visible_indices(gcoord_min, gcoord_max)]
+
+
+    def visible_indices(self, gcoord_min, gcoord_max):
+        """Return the indices of the points inside a rectangle, or a slice of all of them if it contains the whole series."""
+        points = self.points
+        if not len(points) or (numpy.all(points.min(axis=0) >= gcoord_min) and numpy.all(points.max(axis=0) <= gcoord_max)):
+            return slice(None)
+        return self.grid.query(gcoord_min, gcoord_max, points)
+
+
+    def nearest(self, gcoord):
+        """Return the index of the point closest to a position, or None if the series is empty."""
+        return self.grid.nearest(gcoord, self.points)
+
+
+
+class AxesTransform:
+    """Map global coordinates to data values, for whole arrays of points at once.
+
+    Each axis is defined by two points and by the data values at these points.
+    The position along an axis is measured parallel to the other axis, which
+    corrects the rotation and skew of tilted scans; for perfectly horizontal and
+    vertical axes this reduces exactly to the plain ratios of coordinates.
+    The position is then mapped to a value with a linear or log10 scale, and
+    reversed scales run from the end of the axis to its start.
+    """
+
+    def __init__(self, axes_gcoord, axes_scale=(axis_scale.linear, axis_scale.linear), axes_value=((0.0, 1.0), (0.0, 1.0))):
+        (x_start, x_end), (y_start, y_end) = numpy.asarray(axes_gcoord, dtype=numpy.float64)
+        x_direction = x_end - x_start
+        y_direction = y_end - y_start
+        if x_direction[0] == 0 or y_direction[1] == 0:
+            raise ValueError("the x-axis can not be vertical and the y-axis can not be horizontal")
+
+        # Measuring along one axis parallel to the other one: project on the normal of the other axis.
+        self.x_start = x_start
+        self.x_normal = (1.0, -y_direction[0] / y_direction[1])
+        self.x_length = x_direction[0] * self.x_normal[0] + x_direction[1] * self.x_normal[1]
+        self.y_start = y_start
+        self.y_normal = (-x_direction[1] / x_direction[0], 1.0)
+        self.y_length = y_direction[0] * self.y_normal[0] + y_direction[1] * self.y_normal[1]
+        if self.x_length == 0 or self.y_length == 0:
+            raise ValueError("the axes can not be parallel")
+
+        self.axes_scale = tuple(axes_scale)
+        self.axes_value = tuple(tuple(float(value) for value in axis_value) for axis_value in axes_value)
+        for scale, (start_value, end_value) in zip(self.axes_scale, self.axes_value):
+            if scale in (axis_scale.log, axis_scale.log_reversed) and (start_value <= 0 or end_value <= 0):
+                raise ValueError("the values of a log axis must be positive")
+
+
+    def fractions(self, points):
+        """Return the positions of the points along each axis, 0 at the start and 1 at the end."""
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+        x_fraction = ((points[:, 0] - self.x_start[0]) * self.x_normal[0]
+                      + (points[:, 1] - self.x_start[1]) * self.x_normal[1]) / self.x_length
+        y_fraction = ((points[:, 0] - self.y_start[0]) * self.y_normal[0]
+                      + (points[:, 1] - self.y_start[1]) * self.y_normal[1]) / self.y_length
+        return x_fraction, y_fraction
+
+
+    @staticmethod
+    def scale(fraction, scale, axis_value):
+        """Return the values at the fractions of an axis and the derivative of the values."""
+        start_value, end_value = axis_value
+        sign = 1.0
+        if scale in (axis_scale.linear_reversed, axis_scale.log_reversed):
+            fraction = 1.0 - fraction
+            sign = -1.0
+        if scale in (axis_scale.log, axis_scale.log_reversed):
+            log_start, log_end = numpy.log10(start_value), numpy.log10(end_value)
+            value = 10.0 ** (log_start + fraction * (log_end - log_start))
+            return value, sign * value * numpy.log(10.0) * (log_end - log_start)
+        if (start_value, end_value) == (0.0, 1.0) and sign == 1.0:
+            return fraction, 1.0    # Default axis: keep the fractions untouched.
+        return start_value + fraction * (end_value - start_value), sign * (end_value - start_value)
+
+
+    def transform(self, points, pixel_size=1.0):
+        """Return a (n, 4) array of X, X error, Y, Y error for the points.
+
+        The error is the extent of pixel_size, in global coordinates, along each axis.
+        """
+        x_fraction, y_fraction = self.fractions(points)
+        x_value, x_slope = self.scale(x_fraction, self.axes_scale[0], self.axes_value[0])
+        y_value, y_slope = self.scale(y_fraction, self.axes_scale[1], self.axes_value[1])
+
+        data_array = numpy.empty((len(x_fraction), 4))
+        data_array[:, 0] = x_value
+        data_array[:, 1] = pixel_size / self.x_length * x_slope
+        data_array[:, 2] = y_value
+        data_array[:, 3] = -pixel_size / self.y_length * y_slope
+        return data_array
+
+
+def write_csv(filename, data_array):
+    """Write the X, X error, Y, Y error columns in a tab separated file."""
+    row_format = "%1.7f\t%1.7f\t%1.7f\t%1.7f\n"
+    with open(filename, "w") as fp:
+        fp.write("X\t+-\tY\t+-\n")
+        fp.write((row_format * len(data_array)) % tuple(data_array.ravel().tolist()))
+
+
+def trace_color(pixels, color, rect, tolerance=60):
+    """Return the points of a curve of the given color inside a rectangle of the image.
+
+    pixels is the (width, height, 3) array of the image, as given by pygame.surfarray.
+    The pixels closer than tolerance to the color are kept, and each column of the
+    rectangle with such pixels gives one point at their mean height.
+    """
+    x, y, width, height = rect
+    region = pixels[x:x + width, y:y + height]
+
+    # Cheap test on each channel first, then the exact distance for the few candidates.
+    candidates = numpy.ones(region.shape[:2], dtype=bool)
+    for channel in range(3):
+        if color[channel] - tolerance > 0:
+            candidates &= region[:, :, channel] >= color[channel] - tolerance
+        if color[channel] + tolerance < 255:
+            candidates &= region[:, :, channel] <= color[channel] + tolerance
+    columns, rows = numpy.nonzero(candidates)
+    difference = region[columns, rows].astype(numpy.int32) - numpy.asarray(color[:3], dtype=numpy.int32)
+    kept = numpy.einsum("ij,ij->i", difference, difference) <= tolerance * tolerance
+    columns, rows = columns[kept], rows[kept]
+
+    counts = numpy.bincount(columns, minlength=width)
+    rows_sum = numpy.bincount(columns, weights=rows, minlength=width)
+    traced = numpy.flatnonzero(counts)
+    points = numpy.empty((len(traced), 2))
+    points[:, 0] = x + traced + 0.5     # Center of the pixels.
+    points[:, 1] = y + rows_sum[traced] / counts[traced] + 0.5
+    return points
+
+
+def longest_run(line):
+    """Return the start and the end of the longest run of True in a 1D boolean array."""
+    edges = numpy.diff(numpy.concatenate(([0], line.view(numpy.int8), [0])))
+    starts = numpy.flatnonzero(edges == 1)
+    ends = numpy.flatnonzero(edges == -1)
+    if not len(starts):
+        return 0, 0
+    longest = numpy.argmax(ends - starts)
+    return int(starts[longest]), int(ends[longest])
+
+
+def detect_axes(pixels, threshold=100, step=8, candidates=8):
+    """Return the axes found as the longest dark horizontal and vertical lines of the image.
+
+    pixels is the (width, height, 3) array of the image, as given by pygame.surfarray.
+    A pixel is dark when all its channels are below threshold. The rows and columns
+    with the most dark pixels are found on an image subsampled by step across the
+    lines, then the longest run is measured at full resolution on the best of them.
+    """
+    def dark(region):
+        return (region[..., 0] < threshold) & (region[..., 1] < threshold) & (region[..., 2] < threshold)
+
+    # Horizontal lines survive subsampling the columns, and vertical lines subsampling the rows.
+    rows = numpy.argsort(numpy.count_nonzero(dark(pixels[::step]), axis=0))[-candidates:]
+    columns = numpy.argsort(numpy.count_nonzero(dark(pixels[:, ::step]), axis=1))[-candidates:]
+
+    row_runs = [(longest_run(dark(pixels[:, row])), row) for row in rows.tolist()]
+    (x_start, x_end), row = max(row_runs, key=lambda run: run[0][1] - run[0][0])
+    column_runs = [(longest_run(dark(pixels[column])), column) for column in columns.tolist()]
+    (y_start, y_end), column = max(column_runs, key=lambda run: run[0][1] - run[0][0])
+
+    # The y-axis goes upwards, from the bottom of the image.
+    return [[(x_start, row + 0.5), (x_end, row + 0.5)],
+            [(column + 0.5, y_end), (column + 0.5, y_start)]]
+
+
+class SnapMap:
+    """Centers of the features around each pixel of an image, to snap points on the markers and lines.
+
+    The weight of a pixel is its color distance to the background, the median color
+    of the image, less tolerance. The centroid of the weights in the square of radius
+    pixels around each pixel is computed for the whole image at once with cumulative
+    sums, and kept as offsets of 1/16 pixel in int8, so snapping a point is a lookup.
+    Pixels with less than min_weight around them have no feature and do not move the
+    points. scale is the size, in pixels of the image, of the pixels given, for maps
+    built on a smaller level of a tiled image.
+    """
+
+    steps = 16          # Offsets are stored in 1/steps pixel, in int8.
+    no_feature = -128
+
+    def __init__(self, pixels, radius=6, tolerance=40, min_weight=500, scale=1, band_pixels=4_000_000):
+        if radius * self.steps > 127:
+            raise ValueError("the radius of a snap map is at most %d pixels" % (127 // self.steps))
+        self.scale = scale
+        width, height = pixels.shape[:2]
+        background = numpy.median(pixels[::16, ::16].reshape(-1, 3), axis=0).astype(numpy.int16)
+        self.offsets = numpy.empty((width, height, 2), dtype=numpy.int8)
+
+        def box_sum(values, axis):
+            """Return the sums of values in windows of radius along an axis, cut at the edges."""
+            length = values.shape[axis]
+            cumulated = numpy.concatenate((numpy.zeros_like(numpy.take(values, [0], axis)), numpy.cumsum(values, axis)), axis)
+            index = numpy.arange(length)
+            return (numpy.take(cumulated, numpy.minimum(index + radius + 1, length), axis)
+                    - numpy.take(cumulated, numpy.maximum(index - radius, 0), axis))
+
+        band = max(1, band_pixels // max(1, height))   # Columns computed at once, to bound the memory used.
+        for start in range(0, width, band):
+            end = min(width, start + band)
+            halo_start, halo_end = max(0, start - radius), min(width, end + radius)
+            weights = numpy.abs(pixels[halo_start:halo_end].astype(numpy.int16) - background).sum(axis=2) - tolerance
+            weights = numpy.maximum(weights, 0).astype(numpy.float64)
+            columns = numpy.arange(halo_start, halo_end, dtype=numpy.float64)[:, None]
+            rows = numpy.arange(height, dtype=numpy.float64)[None, :]
+            total = box_sum(box_sum(weights, 0), 1)
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                dx = box_sum(box_sum(weights * columns, 0), 1) / total - columns
+                dy = box_sum(box_sum(weights * rows, 0), 1) / total - rows
+                inner = slice(start - halo_start, end - halo_start)
+                offsets = self.offsets[start:end]
+                offsets[..., 0] = numpy.clip(numpy.nan_to_num(numpy.round(dx[inner] * self.steps)), -127, 127)
+                offsets[..., 1] = numpy.clip(numpy.nan_to_num(numpy.round(dy[inner] * self.steps)), -127, 127)
+            offsets[total[inner] < min_weight] = self.no_feature
+
+
+    def snap_many(self, gcoords):
+        """Return the (n, 2) array of the centers of the features around points in global coordinates."""
+        gcoords = numpy.asarray(gcoords, dtype=numpy.float64).reshape(-1, 2)
+        pixels = numpy.floor(gcoords / self.scale).astype(numpy.int64)
+        inside = ((pixels >= 0) & (pixels < self.offsets.shape[:2])).all(axis=1)
+        offsets = numpy.full((len(gcoords), 2), self.no_feature, dtype=numpy.int8)
+        offsets[inside] = self.offsets[pixels[inside, 0], pixels[inside, 1]]
+        snapped = gcoords.copy()
+        found = offsets[:, 0] != self.no_feature
+        snapped[found] = (pixels[found] + 0.5 + offsets[found] / self.steps) * self.scale
+        return snapped
+
+
+    def snap(self, gcoord):
+        """Return the center of the feature around a point in global coordinates, or the point if there is none."""
+        x, y = int(gcoord[0] // self.scale), int(gcoord[1] // self.scale)
+        if not (0 <= x < self.offsets.shape[0] and 0 <= y < self.offsets.shape[1]):
+            return gcoord
+        dx, dy = self.offsets[x, y].tolist()
+        if dx == self.no_feature:
+            return gcoord
+        return ((x + 0.5 + dx / self.steps) * self.scale, (y + 0.5 + dy / self.steps) * self.scale)
+
+
+SESSION_MAGIC = b"ETPS"
+SESSION_VERSION = 1
+EDIT_DTYPE = numpy.dtype([("op", "u1"), ("series", "<i4"), ("index", "<i8"), ("x", "<f8"), ("y", "<f8")])
+JOURNAL_DTYPE = numpy.dtype({"names": ["seq"] + list(EDIT_DTYPE.names),
+                             "formats": ["<u8", "u1", "<i4", "<i8", "<f8", "<f8"],
+                             "offsets": [0, 8, 12, 16, 24, 32], "itemsize": 40})
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    """Unpickler of the older pickled .etp files, refusing anything but the types they contain."""
+
+    allowed = {("numpy", "ndarray"), ("numpy", "dtype"), ("_codecs", "encode"),
+               ("numpy.core.multiarray", "_reconstruct"), ("numpy._core.multiarray", "_reconstruct")}
+
+    def find_class(self, module, name):
+        if name == "marker" and module in ("__main__", "etp"):
+            return marker
+        if (module, name) in self.allowed:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError("forbidden object in session file: " + module + "." + name)
+
+
+def new_session():
+    """Return the data series, the axes and the markers of an image without saved session."""
+    data_gcoord = [Series()]
+    axes_gcoord = [[(0,0), (100,0)],
+                    [(0,100), (0,0)]]
+    axes_scale = [axis_scale.linear, axis_scale.linear]
+    axes_value = [[0.0, 1.0], [0.0, 1.0]]   # Data values at the start and at the end of the axes.
+    series_marker_size = [5.0] * len(data_gcoord)
+    series_marker_shape = [marker.circle] * len(data_gcoord)
+    return data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size, series_marker_shape
+
+
+def session_version(path):
+    """Return the format version of a session file, 0 for older pickled files, None if there is none."""
+    try:
+        with open(path, "rb") as fp:
+            head = fp.read(8)
+    except FileNotFoundError:
+        return None
+    if head[:4] != SESSION_MAGIC:
+        return 0
+    return struct.unpack("<I", head[4:8])[0]
+
+
+def read_session(path):
+    """Return the session stored in a file and the number of the last journal record it contains.
+
+    Session files start with a header giving the axes and, for each series, its markers
+    and the position of its points in the contiguous float64 data that follows. These
+    points are memory-mapped, not read. Older pickled files are still read.
+    """
+    with open(path, "rb") as fp:
+        if fp.read(4) != SESSION_MAGIC:
+            fp.seek(0)
+            chest = LegacyUnpickler(fp).load()
+            data_gcoord, axes_gcoord, series_marker_size, series_marker_shape = chest[:4]
+            data_gcoord = [Series(series_gcoord) for series_gcoord in data_gcoord]   # Lists of tuples in older files.
+            axes_scale = [axis_scale.linear, axis_scale.linear]
+            axes_value = [[0.0, 1.0], [0.0, 1.0]]
+            if len(chest) > 4:  # Axes scales and values are missing in older files.
+                axes_scale = [axis_scale[name] for name in chest[4]]
+                axes_value = chest[5]
+            return (data_gcoord, axes_gcoord, axes_scale, axes_value, list(series_marker_size),
+                    [marker(shape) for shape in series_marker_shape]), 0
+
+        version, header_length = struct.unpack("<II", fp.read(8))
+        if version > SESSION_VERSION:
+            raise ValueError("session file made by a newer version: " + path)
+        header = json.loads(fp.read(header_length))
+
+    total = sum(series["count"] for series in header["series"])
+    data = numpy.empty((0, 2))
+    if total:
+        data = numpy.memmap(path, dtype="<f8", mode="r", offset=header["data_offset"], shape=(total, 2))
+    data_gcoord = []
+    start = 0
+    for series in header["series"]:
+        data_gcoord.append(Series(data[start:start + series["count"]], copy=False))
+        start += series["count"]
+
+    axes_gcoord = [[tuple(gcoord) for gcoord in axis_gcoord] for axis_gcoord in header["axes_gcoord"]]
+    axes_scale = [axis_scale[name] for name in header["axes_scale"]]
+    series_marker_size = [series["marker_size"] for series in header["series"]]
+    series_marker_shape = [marker[series["marker_shape"]] for series in header["series"]]
+    return (data_gcoord, axes_gcoord, axes_scale, header["axes_value"], series_marker_size, series_marker_shape), header["journal_seq"]
+
+
+def unmap_session(data_gcoord):
+    """Copy the points still mapped from a session file, which can not be replaced while mapped on Windows."""
+    for series_gcoord in data_gcoord:
+        series_gcoord.reserve(len(series_gcoord))
+
+
+def write_session(path, chest, journal_seq=0):
+    """Write a session file, atomically."""
+    data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size, series_marker_shape = chest
+    unmap_session(data_gcoord)
+    header = {"axes_gcoord": [[list(gcoord) for gcoord in axis_gcoord] for axis_gcoord in axes_gcoord],
+              "axes_scale": [scale.name for scale in axes_scale],
+              "axes_value": [list(axis_value) for axis_value in axes_value],
+              "series": [{"count": len(series_gcoord), "marker_size": size, "marker_shape": marker(shape).name}
+                         for series_gcoord, size, shape in zip(data_gcoord, series_marker_size, series_marker_shape)],
+              "journal_seq": journal_seq,
+              "data_offset": 0}
+    header_length = len(json.dumps(header)) + 32    # Room for the data offset.
+    header["data_offset"] = -(-(12 + header_length) // 64) * 64   # Aligned start of the points.
+    header_bytes = json.dumps(header).encode().ljust(header["data_offset"] - 12)
+
+    with open(path + ".tmp", "wb") as fp:
+        fp.write(SESSION_MAGIC + struct.pack("<II", SESSION_VERSION, len(header_bytes)) + header_bytes)
+        for series_gcoord in data_gcoord:
+            fp.write(numpy.ascontiguousarray(series_gcoord.points, dtype="<f8").tobytes())
+    os.replace(path + ".tmp", path)
+
+
+def apply_edit(chest, edit):
+    """Apply an edit (operation, series, index, x, y) to a session."""
+    data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size, series_marker_shape = chest
+    op, series, index, x, y = edit
+    if op == operation.append_point:
+        data_gcoord[series].append((x, y))
+    elif op == operation.pop_point:
+        data_gcoord[series].pop(index)
+    elif op == operation.move_point:
+        data_gcoord[series].move(index, x, y)
+    elif op == operation.translate_series:
+        data_gcoord[series].translate(x, y)
+    elif op == operation.add_series:
+        data_gcoord.append(Series())
+        series_marker_size.append(x)
+        series_marker_shape.append(marker(index))
+    elif op == operation.delete_series:
+        if len(data_gcoord) > 1:
+            data_gcoord.pop(series)
+            series_marker_size.pop(series)
+            series_marker_shape.pop(series)
+        else:
+            data_gcoord[0] = Series()
+    elif op == operation.set_marker_size:
+        series_marker_size[series] = x
+    elif op == operation.set_marker_shape:
+        series_marker_shape[series] = marker(index)
+    elif op == operation.set_axis_point:
+        axes_gcoord[series][index] = (x, y)
+    elif op == operation.set_axis_scale:
+        axes_scale[series] = axis_scale(index)
+    elif op == operation.set_axis_value:
+        axes_value[series][index] = x
+    elif op == operation.insert_point:
+        data_gcoord[series].insert(index, (x, y))
+    elif op == operation.insert_series:
+        data_gcoord.insert(series, Series())
+        series_marker_size.insert(series, x)
+        series_marker_shape.insert(series, marker(index))
+
+
+def invert_edit(chest, edit):
+    """Return the array of the edits reverting an edit, before it is applied to a session."""
+    data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size, series_marker_shape = chest
+    op, series, index, x, y = edit
+    if op == operation.append_point:
+        inverse = [(operation.pop_point, series, -1, 0.0, 0.0)]
+    elif op == operation.pop_point:
+        index = range(len(data_gcoord[series]))[index]
+        inverse = [(operation.insert_point, series, index, *data_gcoord[series][index])]
+    elif op == operation.insert_point:
+        inverse = [(operation.pop_point, series, index, 0.0, 0.0)]
+    elif op in (operation.move_point, operation.translate_series):
+        inverse = [(op, series, index, -x, -y)]
+    elif op == operation.add_series:
+        inverse = [(operation.delete_series, len(data_gcoord), 0, 0.0, 0.0)]
+    elif op == operation.insert_series:
+        inverse = [(operation.delete_series, series, 0, 0.0, 0.0)]
+    elif op == operation.delete_series:   # The points of the series are the only edit that is not a delta.
+        points = data_gcoord[series].points
+        inverse = numpy.zeros(len(points) + 1, dtype=EDIT_DTYPE)
+        inverse[0] = (operation.insert_series, series, series_marker_shape[series], series_marker_size[series], 0.0)
+        inverse["op"][1:] = operation.append_point
+        inverse["series"][1:] = series
+        inverse["x"][1:] = points[:, 0]
+        inverse["y"][1:] = points[:, 1]
+        return inverse if len(data_gcoord) > 1 else inverse[1:]  # The only series is emptied, not deleted.
+    elif op == operation.set_marker_size:
+        inverse = [(op, series, 0, series_marker_size[series], 0.0)]
+    elif op == operation.set_marker_shape:
+        inverse = [(op, series, series_marker_shape[series], 0.0, 0.0)]
+    elif op == operation.set_axis_point:
+        inverse = [(op, series, index, *axes_gcoord[series][index])]
+    elif op == operation.set_axis_scale:
+        inverse = [(op, series, axes_scale[series].value, 0.0, 0.0)]
+    elif op == operation.set_axis_value:
+        inverse = [(op, series, index, axes_value[series][index], 0.0)]
+    return numpy.array(inverse, dtype=EDIT_DTYPE)
+
+
+def apply_edits(chest, edits):
+    """Apply an array of edits to a session and return the array of the edits reverting them.
+
+    Runs of points appended to the same series are added at once.
+    """
+    ops, series = edits["op"], edits["series"]
+    run_start = numpy.ones(len(edits), dtype=bool)
+    run_start[1:] = (ops[1:] != operation.append_point) | (ops[1:] != ops[:-1]) | (series[1:] != series[:-1])
+    bounds = numpy.flatnonzero(run_start).tolist() + [len(edits)]
+    inverse = []
+    for start, end in zip(bounds, bounds[1:]):
+        if ops[start] == operation.append_point and end - start > 1:
+            run = edits[start:end]
+            chest[0][int(series[start])].extend(numpy.column_stack((run["x"], run["y"])))
+            pops = numpy.zeros(end - start, dtype=EDIT_DTYPE)
+            pops["op"] = operation.pop_point
+            pops["series"] = series[start]
+            pops["index"] = -1
+            inverse.append(pops)
+        else:
+            for edit in edits[start:end].tolist():
+                inverse.append(invert_edit(chest, edit))
+                apply_edit(chest, edit)
+    return numpy.concatenate(inverse[::-1]) if inverse else numpy.zeros(0, dtype=EDIT_DTYPE)
+
+
+class UndoLog:
+    """Bounded history of the edits of a session, to undo and redo them.
+
+    A command holds the edits of one user action and the edits reverting them,
+    as arrays of deltas. The oldest commands are forgotten once the history
+    takes more than max_bytes, but the last one is always kept, however large.
+    """
+
+    def __init__(self, max_bytes=16 * 2**20):
+        self.max_bytes = max_bytes
+        self.done = deque()
+        self.undone = []
+        self.size = 0
+        self.edits = []     # Edits of the current command.
+        self.inverse = []
+
+
+    def record(self, edits, inverse):
+        """Add edits and the edits reverting them to the current command."""
+        self.edits.append(edits)
+        self.inverse.append(inverse)
+
+
+    def commit(self):
+        """End the current command."""
+        if not self.edits:
+            return
+        command = (numpy.concatenate(self.edits), numpy.concatenate(self.inverse[::-1]))
+        self.edits, self.inverse = [], []
+        for undone_command in self.undone:
+            self.size -= undone_command[0].nbytes + undone_command[1].nbytes
+        self.undone.clear()
+        self.done.append(command)
+        self.size += command[0].nbytes + command[1].nbytes
+        while self.size > self.max_bytes and len(self.done) > 1:    # Forget the oldest commands.
+            forgotten = self.done.popleft()
+            self.size -= forgotten[0].nbytes + forgotten[1].nbytes
+
+
+    def undo(self):
+        """Return the edits reverting the last command, or None if there is none."""
+        self.commit()
+        if not self.done:
+            return None
+        command = self.done.pop()
+        self.undone.append(command)
+        return command[1]
+
+
+    def redo(self):
+        """Return the edits of the last undone command, or None if there is none."""
+        if not self.undone:
+            return None
+        command = self.undone.pop()
+        self.done.append(command)
+        return command[0]
+
+
+class Journal:
+    """Append-only file of the edits made to a session since it was last written.
+
+    Each record is numbered. A session file stores the number of the last record
+    it contains, so the records up to it are skipped when the journal is replayed.
+    """
+
+    def __init__(self, path, seq=0):
+        self.path = path
+        self.seq = seq
+        self.fp = None
+
+
+    def extend(self, edits):
+        """Add an array of edits to the journal."""
+        if self.fp is None:
+            self.fp = open(self.path, "ab")
+        records = numpy.zeros(len(edits), dtype=JOURNAL_DTYPE)
+        records["seq"] = numpy.arange(self.seq + 1, self.seq + len(edits) + 1)
+        for field in EDIT_DTYPE.names:
+            records[field] = edits[field]
+        self.seq += len(edits)
+        self.fp.write(records.tobytes())
+        self.fp.flush()
+
+
+    def replay(self, chest, after_seq):
+        """Apply the edits recorded after a record number to a session. Return the number of edits applied."""
+        try:
+            with open(self.path, "rb") as fp:
+                content = fp.read()
+        except FileNotFoundError:
+            return 0
+        usable = len(content) - len(content) % JOURNAL_DTYPE.itemsize   # A crash can leave a truncated record.
+        records = numpy.frombuffer(content[:usable], dtype=JOURNAL_DTYPE)
+        if len(records):
+            self.seq = max(self.seq, int(records["seq"].max()))
+        records = records[records["seq"] > after_seq]
+        edits = numpy.zeros(len(records), dtype=EDIT_DTYPE)
+        for field in EDIT_DTYPE.names:
+            edits[field] = records[field]
+        apply_edits(chest, edits)
+        return len(edits)
+
+
+    def truncate(self, seq):
+        """Forget the edits, once a session file containing them up to seq is written."""
+        if self.seq == seq:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+def load_session(filename):
+    """Return the data series, the axes and the markers saved for an image, with the journal of its later edits."""
+    journal = Journal(filename + ".etp.journal")
+    try:
+        chest, journal_seq = read_session(filename + ".etp")
+    except FileNotFoundError:
+        if not os.path.exists(journal.path):
+            raise
+        chest, journal_seq = new_session(), 0
+    journal.seq = journal_seq
+    journal.replay(chest, journal_seq)
+    return chest, journal
+
+
+def save_session(filename, chest, journal=None):
+    """Save the working environment of an image and empty its journal."""
+    journal_seq = journal.seq if journal is not None else 0
+    write_session(filename + ".etp", chest, journal_seq)
+    if journal is not None:
+        journal.truncate(journal_seq)
+
+
+class Autosaver:
+    """Save the session of an image from a background thread.
+
+    The session is copied on the UI thread, which only takes a memory copy of the
+    points, and written by the thread, so the UI never waits for the disk. The time
+    taken by the copies and by the writes of the last saves is kept in seconds.
+    """
+
+    def __init__(self, filename, saved_seq=None, every_edits=50, every_seconds=30.0):
+        self.filename = filename
+        self.every_edits = every_edits
+        self.every_seconds = every_seconds
+        self.snapshot_seq = saved_seq   # Last journal record of the copied session.
+        self.saved_seq = saved_seq      # Last journal record of the written session.
+        self.snapshot_time = time.perf_counter()
+        self.snapshot_latency = deque(maxlen=100)
+        self.write_latency = deque(maxlen=100)
+        self.pending = None
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def due(self, journal):
+        """Return True if the session changed enough edits or long enough ago to be saved."""
+        if journal.seq == self.snapshot_seq:
+            return False
+        return (journal.seq - (self.snapshot_seq or 0) >= self.every_edits
+                or time.perf_counter() - self.snapshot_time >= self.every_seconds)
+
+
+    def request(self, chest, journal):
+        """Copy the session for the thread to write it, unless it did not change. Return True if copied."""
+        if journal.seq == self.snapshot_seq:
+            return False
+        start = time.perf_counter()
+        data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size, series_marker_shape = chest
+        unmap_session(data_gcoord)  # The thread writes a copy, the session file is released here.
+        snapshot = ([Series(series_gcoord.points) for series_gcoord in data_gcoord],
+                    [list(axis_gcoord) for axis_gcoord in axes_gcoord], list(axes_scale),
+                    [list(axis_value) for axis_value in axes_value], list(series_marker_size), list(series_marker_shape))
+        with self.condition:
+            self.pending = (snapshot, journal.seq)  # An older copy not written yet is replaced.
+            self.condition.notify()
+        self.snapshot_seq = journal.seq
+        self.snapshot_time = time.perf_counter()
+        self.snapshot_latency.append(self.snapshot_time - start)
+        return True
+
+
+    def run(self):
+        """Write the copies of the session."""
+        while True:
+            with self.condition:
+                while self.pending is None and self.running:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                (snapshot, seq), self.pending = self.pending, None
+            start = time.perf_counter()
+            try:
+                write_session(self.filename + ".etp", snapshot, seq)
+            except OSError as error:    # The journal is kept, nothing is lost.
+                print("Can not save the session:", error)
+            else:
+                self.saved_seq = seq
+                self.write_latency.append(time.perf_counter() - start)
+
+
+    def close(self):
+        """Write the last copy and stop the thread."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+
+    def stats(self):
+        """Return the number, the mean and the maximum durations of the copies and of the writes, in seconds."""
+        return {name: (len(latency), sum(latency) / len(latency) if latency else 0.0, max(latency, default=0.0))
+                for name, latency in (("snapshot", self.snapshot_latency), ("write", self.write_latency))}
+
+
+def compute_coords(data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size, zoom_factor=1.0):
+    """Compute data x and y values based on their coordinates and the axes.
+
+    The errors are the size of the markers on the screen at zoom_factor, at least one pixel.
+    """
+    transform = AxesTransform(axes_gcoord, axes_scale, axes_value)
+    return [transform.transform(series_gcoord.points, max(1.0, marker_size * zoom_factor))
+            for series_gcoord, marker_size in zip(data_gcoord, series_marker_size)]
+
+
+def export_data(filename, data_coord):
+    """Export data x and y values in a file per series."""
+    for i, data_array in enumerate(data_coord):
+        write_csv(filename + "_" + str(i) + ".csv", data_array[data_array[:, 0].argsort()])
+
+
+def make_grid(start, stop, count, log=False):
+    """Return count X values from start to stop, evenly spaced or, with log, evenly spaced in log10."""
+    if log:
+        if start <= 0 or stop <= 0:
+            raise ValueError("the values of a log grid must be positive")
+        return numpy.geomspace(start, stop, count)
+    return numpy.linspace(start, stop, count)
+
+
+def resample(data_coord, grid, log=False):
+    """Return the series interpolated at the X values of a grid, as (len(grid), 4) arrays of X, X error, Y, Y error.
+
+    The values are NaN outside of the range of X of a series. With log, the
+    interpolation is linear in log10(X), the points with X <= 0 being dropped.
+    """
+    grid = numpy.asarray(grid, dtype=numpy.float64)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        grid_x = numpy.log10(grid) if log else grid
+        resampled_coord = []
+        for data_array in data_coord:
+            data_array = data_array[data_array[:, 0].argsort()]
+            x = numpy.log10(data_array[:, 0]) if log else data_array[:, 0]
+            kept = numpy.isfinite(x)
+            resampled = numpy.full((len(grid), 4), numpy.nan)
+            resampled[:, 0] = grid
+            if kept.any():
+                for column in (1, 2, 3):
+                    resampled[:, column] = numpy.interp(grid_x, x[kept], data_array[kept, column],
+                                                        left=numpy.nan, right=numpy.nan)
+            resampled_coord.append(resampled)
+    return resampled_coord
+
+
+class ConsolidatedExport:
+    """Single file with the series of many images, a .npz file or else a tab separated file.
+
+    The CSV file is written as the images are added, with the name of the image
+    and the number of the series on each row. The .npz file holds the names of
+    the series, "image:series", the offsets of their rows and all their rows of
+    X, X error, Y, Y error in one array, row offsets[i] to offsets[i + 1] being
+    the series i, and the grid they were resampled on if any.
+    """
+
+    def __init__(self, filename, grid=None):
+        self.filename = filename
+        self.grid = grid
+        self.names = []
+        self.arrays = []
+        self.fp = None
+        if not filename.endswith(".npz"):
+            self.fp = open(filename, "w")
+            self.fp.write("image\tseries\tX\t+-\tY\t+-\n")
+
+
+    def add(self, filename, data_coord):
+        """Add the series of an image."""
+        name = os.path.basename(filename)
+        for i, data_array in enumerate(data_coord):
+            data_array = data_array[data_array[:, 0].argsort()]
+            if self.fp is not None:
+                row_format = (name + "\t" + str(i)).replace("%", "%%") + "\t%1.7f\t%1.7f\t%1.7f\t%1.7f\n"
+                self.fp.write((row_format * len(data_array)) % tuple(data_array.ravel().tolist()))
+            else:
+                self.names.append(name + ":" + str(i))
+                self.arrays.append(data_array)
+
+
+    def close(self):
+        """Finish the file."""
+        if self.fp is not None:
+            self.fp.close()
+            return
+        offsets = numpy.zeros(len(self.arrays) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(data_array) for data_array in self.arrays])
+        arrays = {"names": numpy.array(self.names, dtype=str), "offsets": offsets,
+                  "data": numpy.concatenate(self.arrays) if self.arrays else numpy.empty((0, 4))}
+        if self.grid is not None:
+            arrays["grid"] = self.grid
+        numpy.savez(self.filename, **arrays)
+
+
+class Session:
+    """Data series, axes and markers of an image, to work on them without pygame or a display.
+
+        session = Session.load("plot.png")
+        session.set_axis(0, (120, 880), (940, 880), values=(1.0, 1000.0), scale=axis_scale.log)
+        session.add_points(session.add_series(), [(300, 500), (400, 450)])
+        session.export()
+        session.save()
+
+    The edits are applied with apply_edits, so they are recorded in the journal of
+    a loaded session as in the window, and saving the session empties the journal.
+    """
+
+    def __init__(self, filename=None, chest=None, journal=None):
+        self.filename = filename
+        self.chest = chest if chest is not None else new_session()
+        self.journal = journal
+
+
+    @classmethod
+    def load(cls, filename):
+        """Return the session saved for an image, or a new one if there is none."""
+        try:
+            chest, journal = load_session(filename)
+        except FileNotFoundError:
+            chest, journal = new_session(), Journal(filename + ".etp.journal")
+        return cls(filename, chest, journal)
+
+
+    @property
+    def data_gcoord(self):
+        return self.chest[0]
+
+
+    @property
+    def axes_gcoord(self):
+        return self.chest[1]
+
+
+    def apply(self, edits):
+        """Apply an array of EDIT_DTYPE edits, or a list of (operation, series, index, x, y), and record them in the journal.
+        Return the edits reverting them."""
+        edits = numpy.asarray(edits, dtype=EDIT_DTYPE)
+        inverse = apply_edits(self.chest, edits)
+        if self.journal is not None:
+            self.journal.extend(edits)
+        return inverse
+
+
+    def set_axis(self, axis, start=None, end=None, values=None, scale=None):
+        """Change the global coordinates of the start and the end of an axis, 0 for x and 1 for y,
+        the data values at these points and the scale of the axis."""
+        edits = []
+        for index, gcoord in enumerate((start, end)):
+            if gcoord is not None:
+                edits.append((operation.set_axis_point, axis, index, *gcoord))
+        for index, value in enumerate(values or ()):
+            edits.append((operation.set_axis_value, axis, index, value, 0.0))
+        if scale is not None:
+            edits.append((operation.set_axis_scale, axis, axis_scale(scale).value, 0.0, 0.0))
+        self.apply(edits)
+
+
+    def add_series(self, marker_size=5.0, marker_shape=marker.circle):
+        """Add an empty series and return its number."""
+        self.apply([(operation.add_series, 0, marker(marker_shape), marker_size, 0.0)])
+        return len(self.data_gcoord) - 1
+
+
+    def add_points(self, series, gcoords):
+        """Add points, in global coordinates, at the end of a series."""
+        gcoords = numpy.asarray(gcoords, dtype=numpy.float64).reshape(-1, 2)
+        edits = numpy.zeros(len(gcoords), dtype=EDIT_DTYPE)
+        edits["op"] = operation.append_point
+        edits["series"] = series
+        edits["x"] = gcoords[:, 0]
+        edits["y"] = gcoords[:, 1]
+        self.apply(edits)
+
+
+    def transform(self, gcoords=None, pixel_size=1.0):
+        """Return the (n, 4) array of X, X error, Y, Y error of points in global coordinates,
+        or the list of these arrays for every series if gcoords is None."""
+        data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size, _ = self.chest
+        if gcoords is None:
+            return compute_coords(data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size)
+        return AxesTransform(axes_gcoord, axes_scale, axes_value).transform(gcoords, pixel_size)
+
+
+    def export(self, filename=None, grid=None, log=False):
+        """Export the data values of the series in a CSV file per series, resampled at the X values
+        of grid if given, see resample(). Return the exported arrays."""
+        data_coord = self.transform()
+        if grid is not None:
+            data_coord = resample(data_coord, grid, log)
+        export_data(filename or self.filename, data_coord)
+        return data_coord
+
+
+    def save(self, filename=None):
+        """Write the session file of the image, or of another image, and empty the journal."""
+        if filename is None or filename == self.filename:
+            save_session(self.filename, self.chest, self.journal)
+        else:
+            save_session(filename, self.chest)
+
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+
+
+def batch_export(filename, grid=None, log=False, keep=False):
+    """Recompute and export the data of a saved image, without display, resampled on grid if given.
+    Return the filename, the duration, the number of series, the error if any and, with keep, the exported arrays."""
+    start = time.perf_counter()
+    try:
+        chest, journal = load_session(filename)
+        journal.close()
+        data_coord = Session(filename, chest).export(grid=grid, log=log)
+    except Exception as error:
+        return filename, time.perf_counter() - start, 0, type(error).__name__ + ": " + str(error), None
+    return filename, time.perf_counter() - start, len(data_coord), None, data_coord if keep else None
+
+
+def run_batch(filenames, workers=None, executor=None, grid=None, log=False, output=None):
+    """Export the data of many saved images in parallel processes and print a summary.
+    The processes of executor are used if given. The data are resampled on grid if given,
+    and also written in the single file output if given, see ConsolidatedExport.
+    Return the files that failed."""
+    start = time.perf_counter()
+    failures = []
+    with contextlib.ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=workers))
+        consolidated = None
+        if output is not None:
+            consolidated = ConsolidatedExport(output, grid)
+            stack.callback(consolidated.close)
+        export = functools.partial(batch_export, grid=grid, log=log, keep=consolidated is not None)
+        for filename, duration, series_count, error, data_coord in executor.map(export, filenames, chunksize=8):
+            if error is None:
+                if consolidated is not None:
+                    consolidated.add(filename, data_coord)
+                print("%8.3f s   %3d series   %s" % (duration, series_count, filename))
+            else:
+                failures.append(filename)
+                print("%8.3f s   FAILED       %s: %s" % (duration, filename, error))
+    print("%d files, %d failed, %.3f s" % (len(filenames), len(failures), time.perf_counter() - start))
+    return failures
+
+
+class WatchCache:
+    """Hashes of the files of a watched directory, and of the inputs of the sessions last exported.
+
+    The inputs of a session are the image, its .etp file and its journal. A file is
+    only read again when its size or its modification time changed, so scanning a
+    directory without changes costs one stat per file. The cache is kept in a
+    JSON file of the directory.
+    """
+
+    session_suffixes = (".etp", ".etp.journal")
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}     # Name -> [size, modification time in ns, hash of the content]
+        self.exported = {}  # Image name -> hash of the inputs of its session when last exported.
+        self.changed_files = False
+        try:
+            with open(path) as fp:
+                cache = json.load(fp)
+            self.files, self.exported = cache["files"], cache["exported"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+
+    @staticmethod
+    def hash_file(path):
+        """Return the SHA-256 of the content of a file."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as fp:
+            for block in iter(lambda: fp.read(2**20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+    def scan(self, directory):
+        """Return the images of the directory whose session inputs changed since they were exported,
+        with the hash of these inputs."""
+        files = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.path == self.path:
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:   # Removed while scanning.
+                    continue
+                cached = self.files.get(entry.name)
+                if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+                    files[entry.name] = cached
+                    continue
+                try:
+                    files[entry.name] = [stat.st_size, stat.st_mtime_ns, self.hash_file(entry.path)]
+                except FileNotFoundError:
+                    continue
+                self.changed_files = True
+        self.changed_files |= files.keys() != self.files.keys()
+        self.files = files
+
+        changed = []
+        for name in {name[:-len(suffix)] for name in files for suffix in self.session_suffixes if name.endswith(suffix)}:
+            inputs = hashlib.sha256()
+            for input_name in (name, name + ".etp", name + ".etp.journal"):
+                inputs.update((input_name + ":" + (files[input_name][2] if input_name in files else "-") + "\n").encode())
+            if self.exported.get(name) != inputs.hexdigest():
+                changed.append((os.path.join(directory, name), inputs.hexdigest()))
+        for name in list(self.exported):    # Sessions deleted from the directory.
+            if name + ".etp" not in files and name + ".etp.journal" not in files:
+                del self.exported[name]
+                self.changed_files = True
+        return sorted(changed)
+
+
+    def save(self):
+        """Write the cache, atomically, if it changed."""
+        if not self.changed_files:
+            return
+        with open(self.path + ".tmp", "w") as fp:
+            json.dump({"files": self.files, "exported": self.exported}, fp)
+        os.replace(self.path + ".tmp", self.path)
+        self.changed_files = False
+
+
+def watch_directory(directory, interval=2.0, workers=None, once=False, grid=None, log=False):
+    """Export the sessions of a directory whose image, session file or journal changed, then scan it
+    again every interval seconds, until interrupted or after one scan with once.
+    The data are resampled on grid if given."""
+    cache = WatchCache(os.path.join(directory, ".etp-watch.json"))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            while True:
+                start = time.perf_counter()
+                changed = cache.scan(directory)
+                if changed:
+                    print("%d changed sessions, scanned in %.3f s" % (len(changed), time.perf_counter() - start))
+                    run_batch([filename for filename, _ in changed], executor=executor, grid=grid, log=log)
+                    for filename, inputs in changed:    # Failed sessions too, they are tried again when they change.
+                        cache.exported[os.path.basename(filename)] = inputs
+                    cache.changed_files = True
+                cache.save()
+                if once:
+                    return 0
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            cache.save()
+            return 0
+
+
+def draw_single_marker_surface(surface, marker_size, zoom_factor, marker_type, center_pos, col, width=0):
+    """"Draw the marker shape on the surface."""
+
+    if marker_type == marker.circle:
+        pygame.draw.circle(surface, col, center_pos, marker_size * zoom_factor, width)
+    elif marker_type == marker.square:
+        square = pygame.Rect(0, 0, 2 * marker_size * zoom_factor, 2 * marker_size * zoom_factor)
+        square.center = center_pos
+        pygame.draw.rect(surface, col, square, width)
+    elif marker_type == marker.rhombus:
+        top_pos     = (center_pos[0], center_pos[1] - marker_size * zoom_factor)
+        right_pos   = (center_pos[0] + marker_size * zoom_factor, center_pos[1])
+        bottom_pos  = (center_pos[0], center_pos[1] + marker_size * zoom_factor)
+        left_pos    = (center_pos[0] - marker_size * zoom_factor, center_pos[1])
+        pygame.draw.polygon(surface, col, [top_pos, right_pos, bottom_pos, left_pos], width)
+    elif marker_type == marker.triangle:
+        top_pos     = (center_pos[0], center_pos[1] - marker_size * zoom_factor)
+        right_pos   = (center_pos[0] + marker_size * zoom_factor * 0.86603, center_pos[1] + marker_size * zoom_factor * 0.5)
+        left_pos    = (center_pos[0] - marker_size * zoom_factor * 0.86603, center_pos[1] + marker_size * zoom_factor * 0.5)
+        pygame.draw.polygon(surface, col, [top_pos, right_pos, left_pos], width)
+    elif marker_type == marker.triangle_inverted:
+        right_pos   = (center_pos[0] + marker_size * zoom_factor * 0.86603, center_pos[1] - marker_size * zoom_factor * 0.5)
+        left_pos    = (center_pos[0] - marker_size * zoom_factor * 0.86603, center_pos[1] - marker_size * zoom_factor * 0.5)
+        bottom_pos     = (center_pos[0], center_pos[1] + marker_size * zoom_factor)
+        pygame.draw.polygon(surface, col, [right_pos, bottom_pos, left_pos], width)
+
+
+class MarkerSprites:
+    """LRU cache of the markers rasterized once on small transparent surfaces.
+
+    Drawing a series is then a single Surface.blits() call with the same sprite,
+    and the alpha of the color is kept when the sprite is blitted.
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.sprites = OrderedDict()    # (shape, size, zoom, color, width) -> (surface, offset of the center)
+
+
+    def get(self, marker_type, marker_size, zoom_factor, col, width=0):
+        """Return the sprite of a marker and the offset of its center."""
+        col = pygame.Color(col)
+        key = (int(marker_type), marker_size, round(zoom_factor, 6), tuple(col), width)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            offset = math.ceil(marker_size * zoom_factor) + 1
+            surface = pygame.Surface((2 * offset + 1, 2 * offset + 1), pygame.SRCALPHA)
+            draw_single_marker_surface(surface, marker_size, zoom_factor, marker_type, (offset, offset), col, width)
+            sprite = self.sprites[key] = (surface, offset)
+            while len(self.sprites) > self.capacity:
+                self.sprites.popitem(last=False)
+        else:
+            self.sprites.move_to_end(key)
+        return sprite
+
+
+    @staticmethod
+    def pixel_positions(centers_pos):
+        """Return the integer positions of the pixels of an array of positions, rounding halves up."""
+        return numpy.floor(numpy.add(centers_pos, 0.5)).astype(numpy.int64)
+
+
+    def draw(self, surface, centers_pos, marker_type, marker_size, zoom_factor, col, width=0, special_flags=0):
+        """Draw the markers at an array of positions on the surface, skipping those outside its clip area.
+        Integer arrays of positions are used as they are, see pixel_positions()."""
+        sprite, offset = self.get(marker_type, marker_size, zoom_factor, col, width)
+        clip = surface.get_clip()
+        if not numpy.issubdtype(centers_pos.dtype, numpy.integer):
+            centers_pos = self.pixel_positions(centers_pos)
+        top_left = centers_pos - offset
+        visible = ((top_left[:, 0] > clip.left - sprite.get_width()) & (top_left[:, 0] < clip.right)
+                   & (top_left[:, 1] > clip.top - sprite.get_height()) & (top_left[:, 1] < clip.bottom))
+        # The blit sequence is zipped in C, building a tuple per marker in Python costs as much as blitting it.
+        if special_flags:
+            blit_sequence = zip(itertools.repeat(sprite), top_left[visible].tolist(), itertools.repeat(None), itertools.repeat(special_flags))
+        else:
+            blit_sequence = zip(itertools.repeat(sprite), top_left[visible].tolist())
+        surface.blits(blit_sequence, doreturn=False)
+
+
+
+class SeriesLayers:
+    """Markers of each series drawn once in their own transparent layer, composited on every frame.
+
+    A layer covers the markers of its series inside the window. It is drawn again
+    when the view, the window, the markers or the alpha of the series change, and
+    only inside the damaged rectangles when some of its points were edited, as the
+    damage covers these edits. When the view is panned by whole pixels, the layer
+    is scrolled and only the uncovered strips are drawn. The markers are drawn with
+    the alpha of their series and merged by their maximum, so overlapping markers of
+    a series do not darken each other, and compositing is a plain blit.
+
+    The screen positions of the points of each series are computed at once and kept
+    until the zoom or the series change, a pan only adding an offset to them.
+    """
+
+    def __init__(self, marker_sprites):
+        self.marker_sprites = marker_sprites
+        self.layers = {}    # id of the series -> [series, view, version, screen rect, surface]
+        self.positions = {} # id of the series -> [series, version, zoom, screen_gcoord, integer screen positions]
+
+
+    def screen_positions(self, series_gcoord, zoom_factor, screen_gcoord):
+        """Return the integer screen positions of all the points of a series."""
+        cached = self.positions.get(id(series_gcoord))
+        if cached is not None and cached[0] is series_gcoord and cached[1:3] == [series_gcoord.version, zoom_factor]:
+            if cached[3] == screen_gcoord:
+                return cached[4]
+            shift = numpy.subtract(cached[3], screen_gcoord) * zoom_factor
+            if numpy.abs(shift - shift.round()).max() < 1e-6:    # Panned by whole pixels.
+                cached[4] += shift.round().astype(numpy.int64)
+                cached[3] = screen_gcoord
+                return cached[4]
+        positions = MarkerSprites.pixel_positions((series_gcoord.points - screen_gcoord) * zoom_factor)
+        self.positions[id(series_gcoord)] = [series_gcoord, series_gcoord.version, zoom_factor, screen_gcoord, positions]
+        return positions
+
+
+    @staticmethod
+    def color(seriesNo, series_count, alpha):
+        """Return the color of the markers of a series."""
+        col = pygame.Color(0, 0, 0)
+        col.hsva = (seriesNo * 350 / series_count, 90, 90, 100)
+        col.a = alpha
+        return col
+
+
+    def draw_markers(self, layer, rect, series_gcoord, seriesNo, view, area):
+        """Draw the markers of a series inside an area of the window on its layer."""
+        zoom_factor, screen_gcoord, _, series_count, marker_size, marker_shape, alpha = view
+        layer.set_clip(area.move(-rect.x, -rect.y))
+        layer.fill((0, 0, 0, 0))
+        margin = marker_size + 1  # Markers centered outside the area can overlap it.
+        indices = series_gcoord.visible_indices(numpy.subtract(screen_gcoord, margin) + numpy.divide(area.topleft, zoom_factor),
+                                                numpy.add(screen_gcoord, margin) + numpy.divide(area.bottomright, zoom_factor))
+        centers_pos = self.screen_positions(series_gcoord, zoom_factor, screen_gcoord)[indices] - rect.topleft
+        self.marker_sprites.draw(layer, centers_pos, marker_shape, marker_size, zoom_factor,
+                                 self.color(seriesNo, series_count, alpha), special_flags=pygame.BLEND_RGBA_MAX)
+        layer.set_clip(None)
+
+
+    def update(self, rects, data_gcoord, series_marker_size, series_marker_shape, alphas, zoom_factor, screen_gcoord, window_size):
+        """Bring the layers up to date, the edited series only inside the damaged rectangles.
+        alphas are the opacities of the series, from 0 to 255."""
+        window = pygame.Rect((0, 0), window_size)
+        live = set()
+        for seriesNo, series_gcoord in enumerate(data_gcoord):
+            live.add(id(series_gcoord))
+            view = (zoom_factor, screen_gcoord, window_size, len(data_gcoord),
+                    series_marker_size[seriesNo], series_marker_shape[seriesNo], alphas[seriesNo])
+            layer = self.layers.get(id(series_gcoord))
+            if layer is not None and layer[0] is series_gcoord and layer[1] == view and layer[2] == series_gcoord.version:
+                continue
+
+            rect = pygame.Rect(0, 0, 0, 0)
+            if len(series_gcoord):
+                offset = math.ceil(series_marker_size[seriesNo] * zoom_factor) + 2
+                top_left = numpy.floor((series_gcoord.points.min(axis=0) - screen_gcoord) * zoom_factor) - offset
+                bottom_right = numpy.ceil((series_gcoord.points.max(axis=0) - screen_gcoord) * zoom_factor) + offset
+                rect = pygame.Rect(top_left.tolist(), (bottom_right - top_left).tolist()).clip(window)
+
+            shift = None
+            if layer is not None and layer[0] is series_gcoord and layer[2] == series_gcoord.version \
+               and layer[1][:1] + layer[1][2:] == view[:1] + view[2:] and layer[4] is not None:
+                shift = numpy.subtract(layer[1][1], screen_gcoord) * zoom_factor
+                shift = shift.round().astype(int).tolist() if numpy.abs(shift - shift.round()).max() < 1e-6 else None
+
+            if layer is not None and layer[0] is series_gcoord and layer[1] == view and layer[3] == rect:
+                for area in rects:  # Only edits inside the damaged rectangles.
+                    area = pygame.Rect(area).clip(rect)
+                    if area.width and area.height:
+                        self.draw_markers(layer[4], rect, series_gcoord, seriesNo, view, area)
+            elif shift is not None and rect.width and rect.height:
+                # Panned by whole pixels: the markers still in the window are moved, not drawn again.
+                moved = layer[3].move(shift)
+                kept = moved.clip(rect)
+                if layer[4].get_size() == rect.size:
+                    surface = layer[4]
+                    surface.scroll(moved.x - rect.x, moved.y - rect.y)
+                else:
+                    surface = pygame.Surface(rect.size, pygame.SRCALPHA)
+                    surface.blit(layer[4], (moved.x - rect.x, moved.y - rect.y), special_flags=pygame.BLEND_RGBA_MAX)
+                if not (kept.width and kept.height):
+                    kept = pygame.Rect(rect.topleft, (0, 0))
+                for area in ((rect.left, rect.top, rect.width, kept.top - rect.top),
+                             (rect.left, kept.bottom, rect.width, rect.bottom - kept.bottom),
+                             (rect.left, kept.top, kept.left - rect.left, kept.height),
+                             (kept.right, kept.top, rect.right - kept.right, kept.height)):
+                    area = pygame.Rect(area)
+                    if area.width > 0 and area.height > 0:
+                        self.draw_markers(surface, rect, series_gcoord, seriesNo, view, area)
+                layer = [series_gcoord, view, None, rect, surface]
+                self.layers[id(series_gcoord)] = layer
+            else:
+                surface = None
+                if layer is not None and layer[4] is not None and layer[4].get_size() == rect.size:
+                    surface = layer[4]  # Reused, as allocating a layer costs as much as drawing it.
+                elif rect.width and rect.height:
+                    surface = pygame.Surface(rect.size, pygame.SRCALPHA)
+                layer = [series_gcoord, view, None, rect, surface]
+                if surface is not None:
+                    self.draw_markers(surface, rect, series_gcoord, seriesNo, view, rect)
+                self.layers[id(series_gcoord)] = layer
+            layer[2] = series_gcoord.version
+
+        for key in list(self.layers):   # Layers of deleted series.
+            if key not in live:
+                del self.layers[key]
+        for key in list(self.positions):
+            if key not in live:
+                del self.positions[key]
+
+
+    def draw(self, surface, data_gcoord):
+        """Blit the layers of the series."""
+        for series_gcoord in data_gcoord:
+            layer = self.layers.get(id(series_gcoord))
+            if layer is not None and layer[4] is not None:
+                surface.blit(layer[4], layer[3])
+
+
+
+IMAGE_READY = None      # Posted when a zoom level finished scaling in the background.
+AUTOSAVE_TICK = None    # Wakes the event loop up to save the session after some time.
+SNAP_MAP_READY = None   # Posted when the snap map of the image is built in the background.
+
+
+def load_pygame():
+    """Import pygame and register the events of the window, once. Return the pygame module."""
+    global pygame, IMAGE_READY, AUTOSAVE_TICK, SNAP_MAP_READY
+    if pygame is None:
+        import pygame
+        import pygame.freetype
+        IMAGE_READY = pygame.event.custom_type()
+        AUTOSAVE_TICK = pygame.event.custom_type()
+        SNAP_MAP_READY = pygame.event.custom_type()
+    return pygame
+
+
+class TiledImage:
+    """Large image stored on disk as memory-mapped tiles, with a pyramid of downsampled levels.
+
+    The image is decoded once and its tiles are written next to it, in
+    <image>.tiles. Each level is half the size of the previous one, down to an
+    overview of at most overview_size pixels. Only the tiles of the regions that
+    are read are loaded from disk.
+    """
+
+    tile_size = 256
+    overview_size = 1024
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "index.json")) as fp:
+            self.index = json.load(fp)
+        self.width, self.height = self.index["size"]
+        self.levels = [numpy.load(os.path.join(directory, "level-%d.npy" % level), mmap_mode="r")
+                       for level in range(len(self.index["levels"]))]
+
+
+    @staticmethod
+    def source_stamp(filename):
+        """Return what identifies a version of the source image."""
+        stat = os.stat(filename)
+        return [stat.st_size, stat.st_mtime_ns]
+
+
+    @classmethod
+    def open(cls, filename):
+        """Return the tiled image of a file, or None if its tiles are missing or older than it."""
+        directory = filename + ".tiles"
+        try:
+            with open(os.path.join(directory, "index.json")) as fp:
+                if json.load(fp)["source"] != cls.source_stamp(filename):
+                    return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(directory)
+
+
+    @staticmethod
+    def downsample(pixels, band_rows):
+        """Return the pixels at half size, each the mean of four, the odd last pixels being dropped.
+        The rows are averaged band_rows at a time, so only a band is held in 16 bits."""
+        width, height = pixels.shape[0] // 2, pixels.shape[1] // 2
+        half = numpy.empty((width, height, 3), dtype=numpy.uint8)
+        for top in range(0, height, band_rows):
+            bottom = min(top + band_rows, height)
+            band = pixels[:2 * width, 2 * top:2 * bottom].astype(numpy.uint16)
+            half[:, top:bottom] = (band[0::2, 0::2] + band[1::2, 0::2] + band[0::2, 1::2] + band[1::2, 1::2] + 2) // 4
+        return half
+
+
+    @classmethod
+    def build(cls, filename, surface):
+        """Write the tiles of a decoded image and return its tiled image."""
+        directory = filename + ".tiles"
+        temporary = directory + ".tmp"
+        for path in (directory, temporary):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        os.mkdir(temporary)
+
+        pixels, _ = image_pixels(surface)
+        size = cls.tile_size
+        levels = []
+        while True:
+            width, height = pixels.shape[:2]
+            tiles = numpy.lib.format.open_memmap(os.path.join(temporary, "level-%d.npy" % len(levels)), mode="w+", dtype=numpy.uint8,
+                                                 shape=(-(-width // size), -(-height // size), size, size, 3))
+            for column in range(tiles.shape[0]):
+                for row in range(tiles.shape[1]):
+                    block = pixels[column * size:(column + 1) * size, row * size:(row + 1) * size]
+                    tiles[column, row, :block.shape[0], :block.shape[1]] = block
+            tiles.flush()
+            levels.append([width, height])
+            if max(width, height) <= cls.overview_size or min(width, height) < 2:
+                break
+            pixels = cls.downsample(pixels, size)
+        del pixels, tiles
+
+        with open(os.path.join(temporary, "index.json"), "w") as fp:
+            json.dump({"source": cls.source_stamp(filename), "size": surface.get_size(),
+                       "tile_size": size, "levels": levels}, fp)
+        os.replace(temporary, directory)
+        return cls(directory)
+
+
+    def get_size(self):
+        return self.width, self.height
+
+
+    def get_width(self):
+        return self.width
+
+
+    def get_height(self):
+        return self.height
+
+
+    def get_rect(self):
+        return pygame.Rect(0, 0, self.width, self.height)
+
+
+    def get_at(self, pos):
+        """Return the color of a pixel."""
+        size = self.tile_size
+        x, y = pos
+        return pygame.Color(*self.levels[0][x // size, y // size, x % size, y % size].tolist())
+
+
+    def level_for(self, zoom_factor):
+        """Return the coarsest level with at least one pixel for each pixel of the screen."""
+        if zoom_factor >= 1:
+            return 0
+        return min(len(self.levels) - 1, int(math.log2(1 / zoom_factor)))
+
+
+    def level_of_at_most(self, pixel_count):
+        """Return the finest level with at most pixel_count pixels, or the overview."""
+        for level, (width, height) in enumerate(self.index["levels"]):
+            if width * height <= pixel_count:
+                return level
+        return len(self.levels) - 1
+
+
+    def pixels(self, rect=None, level=0):
+        """Return the (width, height, 3) array of a rectangle of a level, in the coordinates of that level."""
+        width, height = self.index["levels"][level]
+        rect = pygame.Rect(0, 0, width, height) if rect is None else pygame.Rect(rect).clip((0, 0, width, height))
+        tiles = self.levels[level]
+        size = self.tile_size
+        pixels = numpy.empty((rect.width, rect.height, 3), dtype=numpy.uint8)
+        for column in range(rect.left // size, (rect.right - 1) // size + 1):
+            for row in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                part = rect.clip((column * size, row * size, size, size))
+                pixels[part.left - rect.left:part.right - rect.left, part.top - rect.top:part.bottom - rect.top] = \
+                    tiles[column, row, part.left - column * size:part.right - column * size, part.top - row * size:part.bottom - row * size]
+        return pixels
+
+
+    def region(self, rect, zoom_factor):
+        """Return a surface of a rectangle of the image, from the level suited to the zoom factor."""
+        level = self.level_for(zoom_factor)
+        scale = 2 ** level
+        level_rect = pygame.Rect(rect.left // scale, rect.top // scale, 0, 0)
+        level_rect.width = max(1, -(-rect.right // scale) - level_rect.left)
+        level_rect.height = max(1, -(-rect.bottom // scale) - level_rect.top)
+        return pygame.surfarray.make_surface(self.pixels(level_rect, level))
+
+
+    def overview(self):
+        """Return a surface of the whole image at the coarsest level and its zoom factor."""
+        return pygame.surfarray.make_surface(self.pixels(level=len(self.levels) - 1)), 1 / 2 ** (len(self.levels) - 1)
+
+
+def load_image(filename, tiled_pixels=50_000_000):
+    """Return the image of a file, as a TiledImage above tiled_pixels pixels."""
+    image = TiledImage.open(filename)
+    if image is not None:   # Decoded already.
+        return image
+    surface = pygame.image.load(filename)
+    if surface.get_width() * surface.get_height() < tiled_pixels:
+        return surface
+    return TiledImage.build(filename, surface)
+
+
+def image_pixels(image, pixel_count=16_000_000, copy=False):
+    """Return the (width, height, 3) array of the pixels of an image and the number of image pixels per array pixel.
+
+    A TiledImage is read at its finest level with at most pixel_count pixels.
+    The array of a surface references its pixels, which locks it until the
+    array is deleted, unless copy is True.
+    """
+    if isinstance(image, TiledImage):
+        level = image.level_of_at_most(pixel_count)
+        return image.pixels(level=level), 2 ** level
+    if not copy:
+        try:
+            return pygame.surfarray.pixels3d(image), 1
+        except ValueError:  # Palette images can not be referenced, copy them.
+            pass
+    return pygame.surfarray.array3d(image), 1
+
+
+class ScaledImageCache:
+    """LRU cache of the image scaled at the recently used zoom levels.
+
+    Only the part of the image around the viewport is scaled, so the cost
+    depends on the size of the window and not on the size of the image.
+    When the zoom level changes, the previous level is stretched over the
+    viewport while the new one is prepared in the background.
+    """
+
+    def __init__(self, image, capacity=4, margin=0.5, on_ready=None):
+        self.image = image
+        self.on_ready = on_ready    # Called from the background thread once a zoom level is ready.
+        self.capacity = capacity
+        self.margin = margin        # Extra area scaled around the viewport, as a fraction of its size.
+        self.entries = OrderedDict()    # zoom key -> (zoom_factor, image rect, scaled surface)
+        self.pending = set()
+        self.lock = threading.Lock()
+        if isinstance(image, TiledImage):   # Shown at once, while the levels of the viewport are read.
+            overview, zoom_factor = image.overview()
+            self.store(round(zoom_factor, 6), zoom_factor, image.get_rect(), overview)
+
+
+    def viewport(self, zoom_factor, screen_gcoord, size):
+        """Return the rectangle of the image visible on the screen."""
+        x0 = math.floor(screen_gcoord[0])
+        y0 = math.floor(screen_gcoord[1])
+        x1 = math.ceil(screen_gcoord[0] + size[0] / zoom_factor)
+        y1 = math.ceil(screen_gcoord[1] + size[1] / zoom_factor)
+        return pygame.Rect(x0, y0, x1 - x0, y1 - y0).clip(self.image.get_rect())
+
+
+    def get(self, zoom_factor, screen_gcoord, size):
+        """Return a scaled surface covering the viewport and its position on the screen,
+        or None if no part of the image is visible."""
+        if zoom_factor <= 0:
+            return None
+        view = self.viewport(zoom_factor, screen_gcoord, size)
+        if view.width == 0 or view.height == 0:
+            return None
+
+        key = round(zoom_factor, 6)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1].contains(view):
+                self.entries.move_to_end(key)
+                return entry[2], self.screen_pos(entry[1], zoom_factor, screen_gcoord)
+            previous = next(reversed(self.entries.values()), None)
+
+        if entry is None and previous is not None:  # New zoom level: keep showing the previous one meanwhile.
+            self.prepare_async(key, zoom_factor, view)
+            preview = self.stretch(previous, zoom_factor, screen_gcoord, view)
+            if preview is not None:
+                return preview
+
+        rect = self.expand(view)
+        scaled = self.scale(rect, zoom_factor)
+        self.store(key, zoom_factor, rect, scaled)
+        return scaled, self.screen_pos(rect, zoom_factor, screen_gcoord)
+
+
+    def expand(self, view):
+        """Return the viewport enlarged by the margin, inside the image."""
+        return view.inflate(2 * int(view.width * self.margin),
+                            2 * int(view.height * self.margin)).clip(self.image.get_rect())
+
+
+    def scale(self, rect, zoom_factor):
+        """Return the part of the image in rect scaled by zoom_factor."""
+        size = (max(1, round(rect.width * zoom_factor)), max(1, round(rect.height * zoom_factor)))
+        if isinstance(self.image, TiledImage):
+            return pygame.transform.scale(self.image.region(rect, zoom_factor), size)
+        return pygame.transform.scale(self.image.subsurface(rect), size)
+
+
+    def store(self, key, zoom_factor, rect, scaled):
+        """Insert a scaled surface, dropping the least recently used ones."""
+        with self.lock:
+            self.entries[key] = (zoom_factor, rect, scaled)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+
+    def prepare_async(self, key, zoom_factor, view):
+        """Scale the image at a new zoom level in a background thread."""
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+
+        def prepare():
+            rect = self.expand(view)
+            scaled = self.scale(rect, zoom_factor)
+            self.store(key, zoom_factor, rect, scaled)
+            with self.lock:
+                self.pending.discard(key)
+            if self.on_ready is not None:
+                self.on_ready()
+
+        threading.Thread(target=prepare, daemon=True).start()
+
+
+    def stretch(self, entry, zoom_factor, screen_gcoord, view):
+        """Return a cached entry of another zoom level stretched over the viewport."""
+        entry_zoom, entry_rect, entry_surface = entry
+        common = entry_rect.clip(view)
+        if common.width == 0 or common.height == 0:
+            return None
+        source = pygame.Rect(round((common.x - entry_rect.x) * entry_zoom),
+                             round((common.y - entry_rect.y) * entry_zoom),
+                             max(1, round(common.width * entry_zoom)),
+                             max(1, round(common.height * entry_zoom))).clip(entry_surface.get_rect())
+        if source.width == 0 or source.height == 0:
+            return None
+        size = (max(1, round(common.width * zoom_factor)), max(1, round(common.height * zoom_factor)))
+        return (pygame.transform.scale(entry_surface.subsurface(source), size),
+                self.screen_pos(common, zoom_factor, screen_gcoord))
+
+
+    @staticmethod
+    def screen_pos(rect, zoom_factor, screen_gcoord):
+        """Return the position on the screen of the top left of an image rectangle."""
+        return (round((rect.x - screen_gcoord[0]) * zoom_factor),
+                round((rect.y - screen_gcoord[1]) * zoom_factor))
+
+
+class FrameProfiler:
+    """Durations of the stages of the frames, for the on-screen timings and a trace file.
+
+    The last durations of each stage are kept for rolling means. With a trace
+    path, every timed section is also kept as a complete event of the Chrome
+    trace format, which chrome://tracing and Perfetto open, and written by write().
+    """
+
+    def __init__(self, trace_path=None, window=120):
+        self.trace_path = trace_path
+        self.window = window
+        self.durations = {}     # Stage name: last durations in seconds.
+        self.frame_times = deque(maxlen=window)
+        self.events = []
+        self.origin = time.perf_counter()
+
+
+    @contextlib.contextmanager
+    def section(self, name):
+        """Time the code of a with block as a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter())
+
+
+    def add(self, name, start, end):
+        """Record a stage from its start and end times."""
+        if name not in self.durations:
+            self.durations[name] = deque(maxlen=self.window)
+        self.durations[name].append(end - start)
+        if self.trace_path is not None:
+            self.events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                                "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6})
+
+
+    def frame(self):
+        """Mark the end of a frame."""
+        self.frame_times.append(time.perf_counter())
+
+
+    def fps(self):
+        """Return the frame rate of the last frames."""
+        if len(self.frame_times) < 2:
+            return 0.0
+        return (len(self.frame_times) - 1) / max(self.frame_times[-1] - self.frame_times[0], 1e-9)
+
+
+    def means(self):
+        """Return the mean of the last durations of each stage, in seconds."""
+        return {name: sum(durations) / len(durations) for name, durations in self.durations.items()}
+
+
+    def write(self):
+        """Write the timed sections to the trace file."""
+        with open(self.trace_path, "w") as fp:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, fp)
+
+
+class StartupReport:
+    """Phases of the start of the program until the first frame of the window, printed by --startup-report.
+
+    Phases can run at the same time in other threads, their start is kept to show it.
+    """
+
+    def __init__(self, origin=START_TIME):
+        self.origin = origin
+        self.phases = []    # (name, start, end)
+
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the code of a with block as a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter())
+
+
+    def add(self, name, start, end):
+        """Record a phase from its start and end times."""
+        self.phases.append((name, start, end))
+
+
+    def print(self):
+        """Print the phases in the order they started, and the time to the first frame."""
+        print("Startup:")
+        for name, start, end in sorted(self.phases, key=lambda phase: phase[1]):
+            print("  %-12s %8.1f ms   from %8.1f ms" % (name, (end - start) * 1000, (start - self.origin) * 1000))
+        print("  %-12s %8.1f ms" % ("first frame", (max(end for _, _, end in self.phases) - self.origin) * 1000))
+
+
+class DirtyRenderer:
+    """Redraw and present only the damaged regions of the window.
+
+    The scene (image, axes, markers and controls) is kept in a back buffer and
+    repainted only inside the damaged rectangles. The cursor marker is drawn over
+    it directly on the screen, so moving the mouse only restores and redraws two
+    small rectangles.
+    """
+
+    max_rects = 16  # Above this many damaged rectangles, their union is redrawn instead.
+
+    def __init__(self, screen, draw_scene, draw_cursor, profiler=None, prepare_scene=None):
+        self.screen = screen
+        self.draw_scene = draw_scene    # draw_scene(surface) draws the whole scene, clipping is done here.
+        self.draw_cursor = draw_cursor  # draw_cursor(surface) returns the rectangle drawn, or None.
+        self.profiler = profiler
+        self.prepare_scene = prepare_scene  # prepare_scene(rects) is called once before the damaged rectangles are drawn.
+        self.back = pygame.Surface(screen.get_size())
+        self.scene_damage = [self.back.get_rect()]
+        self.cursor_damaged = True
+        self.cursor_rect = None
+
+
+    def resize(self):
+        """Follow a change of the window size."""
+        self.back = pygame.Surface(self.screen.get_size())
+        self.damage()
+
+
+    def damage(self, *rects):
+        """Mark regions of the scene to be redrawn, or all the scene if none is given."""
+        if not rects:
+            self.scene_damage = [self.back.get_rect()]
+        else:
+            self.scene_damage.extend(pygame.Rect(rect) for rect in rects if rect is not None)
+
+
+    def damage_cursor(self):
+        """Mark the cursor marker to be redrawn."""
+        self.cursor_damaged = True
+
+
+    def pending(self):
+        """Return True if something has to be redrawn."""
+        return bool(self.scene_damage) or self.cursor_damaged
+
+
+    def merged_damage(self):
+        """Return the damaged rectangles inside the window, merged when there are too many."""
+        bounds = self.back.get_rect()
+        rects = [rect.clip(bounds) for rect in self.scene_damage]
+        rects = [rect for rect in rects if rect.width > 0 and rect.height > 0]
+        if len(rects) > self.max_rects:
+            rects = [rects[0].unionall(rects[1:])]
+        return rects
+
+
+    def section(self, name):
+        """Time a stage of the rendering, if profiled."""
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.section(name)
+
+
+    def render(self):
+        """Redraw the damaged regions and push them to the display."""
+        if not self.pending():
+            return
+
+        with self.section("scene"):
+            rects = self.merged_damage()
+            if self.prepare_scene is not None:
+                self.prepare_scene(rects)
+            for rect in rects:
+                self.back.set_clip(rect)
+                self.draw_scene(self.back)
+            self.back.set_clip(None)
+            self.scene_damage = []
+
+        with self.section("cursor"):
+            updated = list(rects)
+            if self.cursor_rect is not None:
+                updated.append(self.cursor_rect)
+            for rect in updated:
+                self.screen.blit(self.back, rect, rect)
+
+            self.cursor_rect = self.draw_cursor(self.screen)
+            if self.cursor_rect is not None:
+                self.cursor_rect = self.cursor_rect.clip(self.screen.get_rect())
+                updated.append(self.cursor_rect)
+            self.cursor_damaged = False
+
+        with self.section("present"):
+            pygame.display.update(updated)
+
+
+class PlotScene:
+    """Image, axes and markers of a session as drawn in the window, without the overlays.
+
+    The markers are composited from the layers of the series, which prepare()
+    brings up to date before the damaged rectangles are drawn with draw(). The
+    window and the benchmarks draw through it.
+    """
+
+    def __init__(self, image_cache, marker_sprites, chest, profiler=None):
+        self.image_cache = image_cache
+        self.series_layers = SeriesLayers(marker_sprites)
+        self.chest = chest
+        self.profiler = profiler
+
+
+    @staticmethod
+    def alphas(series_count, edited_seriesNo=None):
+        """Return the opacity of each series, from 0 to 255.
+        Higher transparency while a series is edited, except for that series."""
+        return [round((30 if edited_seriesNo is not None and seriesNo != edited_seriesNo else 70) * 2.55)
+                for seriesNo in range(series_count)]
+
+
+    def section(self, name):
+        """Time a stage of the drawing, if profiled."""
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.section(name)
+
+
+    def prepare(self, rects, alphas, zoom_factor, screen_gcoord, window_size):
+        """Update the layers of the series before the damaged rectangles are drawn."""
+        data_gcoord, _, _, _, series_marker_size, series_marker_shape = self.chest
+        with self.section("layers"):
+            self.series_layers.update(rects, data_gcoord, series_marker_size, series_marker_shape,
+                                      alphas, zoom_factor, screen_gcoord, window_size)
+
+
+    def draw_image(self, surface, zoom_factor, screen_gcoord):
+        """Draw the visible part of the scaled image."""
+        sized_graph = self.image_cache.get(zoom_factor, screen_gcoord, surface.get_size())
+        if sized_graph is not None:
+            surface.blit(*sized_graph)
+
+
+    def draw(self, surface, zoom_factor, screen_gcoord):
+        """Draw the image, the axes and the markers of the series."""
+        data_gcoord, axes_gcoord = self.chest[:2]
+        with self.section("image"):
+            surface.fill("grey")
+            self.draw_image(surface, zoom_factor, screen_gcoord)
+        with self.section("markers"):
+            for axis_gcoord in axes_gcoord:
+                pygame.draw.line(surface, "red", (numpy.subtract(axis_gcoord[0], screen_gcoord) * zoom_factor).tolist(),
+                                 (numpy.subtract(axis_gcoord[1], screen_gcoord) * zoom_factor).tolist())
+            self.series_layers.draw(surface, data_gcoord)
+
+
+def load_document(filename, startup=None):
+    """Return the image of a file, its session and the journal of the session, loaded at the same time.
+    The loading is timed in startup if given."""
+    def load(name, function):
+        start = time.perf_counter()
+        result = function()
+        if startup is not None:
+            startup.add(name, start, time.perf_counter())
+        return result
+
+    def load_or_new_session():
+        try:
+            return load_session(filename)
+        except FileNotFoundError:
+            return new_session(), Journal(filename + ".etp.journal")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        image = executor.submit(load, "image", lambda: load_image(filename))
+        chest, journal = load("session", load_or_new_session)
+        return image.result(), chest, journal
+
+
+class Prefetcher:
+    """Load the next files in a background thread while the current one is analyzed.
+
+    At most depth files are loaded ahead, which bounds the memory used. A file
+    is loaded again each time it is opened, so its session is never stale.
+    """
+
+    def __init__(self, filenames, depth=2):
+        self.filenames = filenames
+        self.depth = depth
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.futures = {}
+
+
+    def ready(self, index):
+        """Return True if a file is loaded already."""
+        future = self.futures.get(index)
+        return future is not None and future.done() and not future.cancelled()
+
+
+    def get(self, index, startup=None):
+        """Return the loaded document of a file, waiting for it if it is being loaded.
+        A file not loaded in the background is loaded now and timed in startup if given."""
+        future = self.futures.pop(index, None)
+        if future is None or future.cancelled():
+            return load_document(self.filenames[index], startup)
+        return future.result()
+
+
+    def prefetch(self, index):
+        """Load the files following a file, forgetting the others."""
+        ahead = range(index + 1, min(len(self.filenames), index + 1 + self.depth))
+        for other in list(self.futures):
+            if other not in ahead:
+                self.futures.pop(other).cancel()
+        for other in ahead:
+            if other not in self.futures:
+                self.futures[other] = self.executor.submit(load_document, self.filenames[other])
+
+
+    def close(self):
+        self.futures.clear()
+        self.executor.shutdown(cancel_futures=True)
+
+
+def analyze_pictures(filenames, auto_axes=False, autosave_edits=50, autosave_seconds=30.0, profiler=None, prefetch=2, snap=False,
+                     startup=None):
+    """Analyze images one after the other in the same window, PAGEUP and PAGEDOWN switching between them.
+    The start until the first frame is timed in startup if given."""
+    if not filenames:
+        return
+    timing = startup if startup is not None else StartupReport()
+    with timing.phase("pygame"):
+        load_pygame()
+        pygame.init()
+    with timing.phase("window"):
+        screen = pygame.display.set_mode((1000, 1000), pygame.RESIZABLE | pygame.HWSURFACE | pygame.DOUBLEBUF)
+        font = pygame.freetype.Font(None, 16)
+    prefetcher = Prefetcher(filenames, prefetch)
+    try:
+        index = 0
+        while index is not None:
+            if not prefetcher.ready(index):    # Shown while the image and the session are loaded.
+                screen.fill("grey")
+                font.render_to(screen, (10, 10), "Loading " + os.path.basename(filenames[index]) + "...", (255, 255, 255))
+                pygame.display.flip()
+            document = prefetcher.get(index, startup)
+            prefetcher.prefetch(index)
+            step = analyze_picture(filenames[index], auto_axes, autosave_edits, autosave_seconds, profiler,
+                                   document, (index, len(filenames)), snap, startup)
+            startup = None  # Only the first image is timed.
+            index = None if step is None else index + step
+    finally:
+        prefetcher.close()
+        pygame.quit()
+
+
+def analyze_picture(filename, auto_axes=False, autosave_edits=50, autosave_seconds=30.0, profiler=None,
+                    document=None, position=(0, 1), snap=False, startup=None):
+    """The whole analysis for one image.
+    With auto_axes, the axes of an image without saved session are detected on load.
+    The stages of the frames are timed with profiler, a new one if None.
+    document is the image, session and journal given by load_document(), loaded here if None.
+    position is the index of the image among the images analyzed in the same window and their number.
+    With snap, the added points are snapped on the features of the image, G toggling it.
+    With startup, the phases until the first frame are timed and printed, see StartupReport.
+    Return the step to the next image to analyze, or None when the window is closed."""
+
+    setup_start = time.perf_counter()
+    load_pygame()
+    own_window = pygame.display.get_surface() is None
+    if own_window:
+        pygame.init()
+        pygame.display.set_mode((1000, 1000), pygame.RESIZABLE | pygame.HWSURFACE | pygame.DOUBLEBUF)
+    screen = pygame.display.get_surface()
+    caption = "Exhume This Plot"
+    if position[1] > 1:
+        caption += " - %s (%d/%d)" % (os.path.basename(filename), position[0] + 1, position[1])
+    pygame.display.set_caption(caption)
+    running = True
+    next_step = None
+
+    if document is None:
+        document = load_document(filename)
+    asurf, chest, journal = document
+    image_cache = ScaledImageCache(asurf, on_ready=lambda: pygame.event.post(pygame.event.Event(IMAGE_READY)))
+    marker_sprites = MarkerSprites()
+    default_font = pygame.freetype.Font(None, 16)   # What SysFont(None, 16) returns, without its slow search of the system fonts.
+    default_font.antialiased = True
+    controls_panels = {}    # Rendered controls, by text, display of the controls and window width.
+    if profiler is None:
+        profiler = FrameProfiler()
+    snap_maps = []  # The snap map of the image, once built in the background.
+    snap_pending = []   # Series to snap once the snap map is built.
 
     zoom_factor = 1.0
     screen_gcoord = (0,0) # Top left of the screen
     marker_size = 5.0
 
-    sized_graph = pygame.transform.scale_by(asurf, zoom_factor)
-    screen.blit(sized_graph, screen_gcoord)
-
 
     # Nomenclature of the positions:
     #
@@ -85,28 +2314,25 @@ def analyze_picture(filename):
     #           The true value of the data that is calculated whith
     #           respect to the axes then exported.
 
-    data_coord = []
-
-    series_gcoord = []
-    data_gcoord = [series_gcoord]
+    data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size, series_marker_shape = chest
+    plot_scene = PlotScene(image_cache, marker_sprites, chest, profiler)
     working_series = 0
     
     edit_seriesNo_itemNo = [0,0]
 
-    axes_gcoord = [[(0,0), (100,0)],
-                    [(0,100), (0,0)]]
-    
-    series_marker_size = [marker_size] * len(data_gcoord)
-    series_marker_shape = [marker.circle] * len(data_gcoord)
 
-    try:
-        with open(filename + ".etp", "rb") as fp:
-            chest = pickle.load(fp)
-            data_gcoord, axes_gcoord, series_marker_size, series_marker_shape = chest
-            working_series = 0
-            edit_seriesNo_itemNo = [0,0]
-    except FileNotFoundError:
-        pass
+    undo_log = UndoLog()
+
+
+    def edit(op, series=0, index=0, x=0.0, y=0.0):
+        """Apply an edit to the session and record it."""
+        edit_many(numpy.array([(op, series, index, x, y)], dtype=EDIT_DTYPE))
+
+
+    def edit_many(edits):
+        """Apply an array of edits to the session and record them in the journal and in the undo history."""
+        undo_log.record(edits, apply_edits(chest, edits))
+        journal.extend(edits)
 
 
     def gcoord_to_pos(gcoord, zoom_factor, screen_gcoord):
@@ -121,13 +2347,55 @@ def analyze_picture(filename):
                 (pos[1] / zoom_factor + screen_gcoord[1]))
 
 
+    def build_snap_map():
+        """Start building the snap map of the image in a background thread, and return the thread.
+        SNAP_MAP_READY is posted with it once it is built."""
+        if isinstance(asurf, TiledImage):   # The tiles are read in the background too.
+            read = lambda: image_pixels(asurf)
+        else:
+            copied = image_pixels(asurf, copy=True)     # The image can not stay locked while it is drawn.
+            read = lambda: copied
+
+        def build():
+            pixels, scale = read()
+            snap_map = SnapMap(pixels, scale=scale)
+            snap_maps.append(snap_map)
+            pygame.event.post(pygame.event.Event(SNAP_MAP_READY, snap_map=snap_map))
+
+        thread = threading.Thread(target=build, daemon=True)
+        thread.start()
+        return thread
+
+
+    def snapped(gcoord):
+        """Return the center of the feature under a point in snap mode, once the snap map is built, else the point."""
+        if snap_enabled and snap_maps:
+            return snap_maps[0].snap(gcoord)
+        return gcoord
+
+
+    def snap_series(seriesNo):
+        """Move all the points of a series to the centers of the features under them."""
+        if not snap_maps:
+            return
+        points = data_gcoord[seriesNo].points
+        moves = snap_maps[0].snap_many(points) - points
+        moved = numpy.flatnonzero(moves.any(axis=1))
+        edits = numpy.zeros(len(moved), dtype=EDIT_DTYPE)
+        edits["op"] = operation.move_point
+        edits["series"] = seriesNo
+        edits["index"] = moved
+        edits["x"], edits["y"] = moves[moved, 0], moves[moved, 1]
+        edit_many(edits)
+
+
     def ask_axis(type, zoom_factor, screen_gcoord):
         """Ask the user to define an axis."""
         gcoords = []
         local_running = True
 
         while local_running:
-            for event in pygame.event.get():
+            for event in [pygame.event.wait()] + pygame.event.get():  # Sleep until something happens.
                 if event.type == pygame.QUIT:
                     raise QuitEvent("quit event during axes setup")
 
@@ -135,7 +2403,9 @@ def analyze_picture(filename):
                     if event.button == 1: # Choose point
                         if len(gcoords) == 0 : gcoords.append(pos_to_gcoord(pygame.mouse.get_pos(), zoom_factor, screen_gcoord))
                         elif len(gcoords) == 1 :
-                            if type == axis_type.x:
+                            if pygame.key.get_pressed()[pygame.K_LALT]:   # Tilted axis of a skewed scan.
+                                gcoords.append(pos_to_gcoord(pygame.mouse.get_pos(), zoom_factor, screen_gcoord))
+                            elif type == axis_type.x:
                                 gcoords.append((pos_to_gcoord(pygame.mouse.get_pos(), zoom_factor, screen_gcoord)[0],
                                                 gcoords[0][1]))
                             elif type == axis_type.y:
@@ -165,10 +2435,14 @@ def analyze_picture(filename):
             
             # Draw temp axis to help plotting the end.
             screen.fill("grey")
-            sized_graph = pygame.transform.scale_by(asurf, zoom_factor)
-            screen.blit(sized_graph, gcoord_to_pos((0,0), zoom_factor, screen_gcoord))
+            plot_scene.draw_image(screen, zoom_factor, screen_gcoord)
             if len(gcoords) == 1:
-                if type == axis_type.x:
+                if pygame.key.get_pressed()[pygame.K_LALT]:
+                    pygame.draw.line(screen,
+                                    "red",
+                                    gcoord_to_pos(gcoords[0], zoom_factor, screen_gcoord),
+                                    pygame.mouse.get_pos())
+                elif type == axis_type.x:
                     pygame.draw.line(screen,
                                     "red",
                                     gcoord_to_pos(gcoords[0], zoom_factor, screen_gcoord),
@@ -179,247 +2453,375 @@ def analyze_picture(filename):
                                     gcoord_to_pos(gcoords[0], zoom_factor, screen_gcoord),
                                     (gcoord_to_pos(gcoords[0], zoom_factor, screen_gcoord)[0], pygame.mouse.get_pos()[1]))
             pygame.display.flip()
-            clock.tick(60)
 
             
 
         return gcoords[0], gcoords[1]
 
 
-    def draw_single_marker_surface(marker_size, zoom_factor, marker_type, center_pos, col, width=0):
-        """"Return a surface containing the marker shape."""
-        
-        # This line takes too much time! 
-        #surface = pygame.Surface((screen.get_width(), screen.get_height()), pygame.SRCALPHA)
-
-        surface=screen
-
-        if marker_type == marker.circle:
-            pygame.draw.circle(surface, col, center_pos, marker_size * zoom_factor, width)
-        elif marker_type == marker.square:
-            square = pygame.Rect(0, 0, 2 * marker_size * zoom_factor, 2 * marker_size * zoom_factor)
-            square.center = center_pos
-            pygame.draw.rect(surface, col, square, width)
-        elif marker_type == marker.rhombus:
-            top_pos     = (center_pos[0], center_pos[1] - marker_size * zoom_factor)
-            right_pos   = (center_pos[0] + marker_size * zoom_factor, center_pos[1])
-            bottom_pos  = (center_pos[0], center_pos[1] + marker_size * zoom_factor)
-            left_pos    = (center_pos[0] - marker_size * zoom_factor, center_pos[1])
-            pygame.draw.polygon(surface, col, [top_pos, right_pos, bottom_pos, left_pos], width)
-        elif marker_type == marker.triangle:
-            top_pos     = (center_pos[0], center_pos[1] - marker_size * zoom_factor)
-            right_pos   = (center_pos[0] + marker_size * zoom_factor * 0.86603, center_pos[1] + marker_size * zoom_factor * 0.5)
-            left_pos    = (center_pos[0] - marker_size * zoom_factor * 0.86603, center_pos[1] + marker_size * zoom_factor * 0.5)
-            pygame.draw.polygon(surface, col, [top_pos, right_pos, left_pos], width)
-        elif marker_type == marker.triangle_inverted:
-            right_pos   = (center_pos[0] + marker_size * zoom_factor * 0.86603, center_pos[1] - marker_size * zoom_factor * 0.5)
-            left_pos    = (center_pos[0] - marker_size * zoom_factor * 0.86603, center_pos[1] - marker_size * zoom_factor * 0.5)
-            bottom_pos     = (center_pos[0], center_pos[1] + marker_size * zoom_factor)
-            pygame.draw.polygon(surface, col, [right_pos, bottom_pos, left_pos], width)
-
-        #return surface
-
-
-    def draw_marker(screen, zoom_factor, screen_gcoord, coord, col, marker_size, marker_type, width=0, position=False):
+    def ask_region(zoom_factor, screen_gcoord):
+        """Ask the user to draw a rectangle with two clicks. Return it in global coordinates."""
+        gcoords = []
+
+        while len(gcoords) < 2:
+            for event in [pygame.event.wait()] + pygame.event.get():  # Sleep until something happens.
+                if event.type == pygame.QUIT:
+                    raise QuitEvent("quit event during region setup")
+
+                elif event.type == pygame.MOUSEBUTTONDOWN:
+                    if event.button == 1: # Choose corner
+                        gcoords.append(pos_to_gcoord(pygame.mouse.get_pos(), zoom_factor, screen_gcoord))
+                    elif event.button == 3: # Cancel
+                        if len(gcoords) == 1:
+                            gcoords.pop(0)
+
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        return None
+                    elif event.key == pygame.K_UP:
+                        screen_gcoord = (screen_gcoord[0], screen_gcoord[1] - 100 * zoom_factor)
+                    elif event.key == pygame.K_DOWN:
+                        screen_gcoord = (screen_gcoord[0], screen_gcoord[1] + 100 * zoom_factor)
+                    elif event.key == pygame.K_RIGHT:
+                        screen_gcoord = (screen_gcoord[0] + 100 * zoom_factor, screen_gcoord[1])
+                    elif event.key == pygame.K_LEFT:
+                        screen_gcoord = (screen_gcoord[0] - 100 * zoom_factor, screen_gcoord[1])
+                elif event.type == pygame.MOUSEWHEEL:
+                    if pygame.key.get_pressed()[pygame.K_LCTRL] or pygame.key.get_pressed()[pygame.K_RCTRL]:
+                        zoom_factor = max(0, zoom_factor + event.y*0.1)
+
+            # Draw the rectangle from the first corner to the mouse.
+            screen.fill("grey")
+            plot_scene.draw_image(screen, zoom_factor, screen_gcoord)
+            if len(gcoords) == 1:
+                corner_pos = gcoord_to_pos(gcoords[0], zoom_factor, screen_gcoord)
+                mouse_pos = pygame.mouse.get_pos()
+                pygame.draw.rect(screen, "red", pygame.Rect(min(corner_pos[0], mouse_pos[0]), min(corner_pos[1], mouse_pos[1]),
+                                                            abs(corner_pos[0] - mouse_pos[0]), abs(corner_pos[1] - mouse_pos[1])), 1)
+            pygame.display.flip()
+
+        (x0, y0), (x1, y1) = gcoords
+        return (min(x0, x1), min(y0, y1)), (max(x0, x1), max(y0, y1))
+
+
+    def auto_trace(color):
+        """Ask for a region and add a new series following the curve of the given color inside it."""
+        region = ask_region(zoom_factor, screen_gcoord)
+        if region is None:
+            return None
+        (x0, y0), (x1, y1) = region
+        rect = pygame.Rect(math.floor(x0), math.floor(y0), math.ceil(x1) - math.floor(x0), math.ceil(y1) - math.floor(y0)).clip(asurf.get_rect())
+        if isinstance(asurf, TiledImage):   # Only the tiles of the region are read.
+            return trace_color(asurf.pixels(rect), color, pygame.Rect((0, 0), rect.size)) + rect.topleft
+        pixels, _ = image_pixels(asurf)
+        points = trace_color(pixels, color, rect)
+        del pixels  # Release the lock of the image.
+        return points
+
+
+    def find_axes():
+        """Detect the axes in the image."""
+        pixels, scale = image_pixels(asurf)     # A TiledImage on a level small enough to be read at once.
+        axes = [[(x * scale, y * scale) for x, y in axis_gcoord] for axis_gcoord in detect_axes(pixels)]
+        del pixels  # Release the lock of the image.
+        return axes
+
+
+    def confirm_axes(detected_axes):
+        """Show detected axes and return True if the user accepts them."""
+        text_string = "Detected axes: RETURN to accept (then X or Y to adjust one of them), ESCAPE to reject"
+
+        while True:
+            screen.fill("grey")
+            plot_scene.draw_image(screen, zoom_factor, screen_gcoord)
+            for axis_coord in detected_axes:
+                pygame.draw.line(screen,
+                                "blue",
+                                gcoord_to_pos(axis_coord[0], zoom_factor, screen_gcoord),
+                                gcoord_to_pos(axis_coord[1], zoom_factor, screen_gcoord), 3)
+            text_Rect = default_font.get_rect(text_string)
+            prompt_Rect = pygame.Rect(0, screen.get_height() - text_Rect.height, screen.get_width(), text_Rect.height)
+            pygame.draw.rect(screen, (100, 100, 100), prompt_Rect)
+            default_font.render_to(screen, prompt_Rect.topleft, text_string, (255, 255, 255))
+            pygame.display.flip()
+
+            for event in [pygame.event.wait()] + pygame.event.get():
+                if event.type == pygame.QUIT:
+                    raise QuitEvent("quit event during axes confirmation")
+                elif event.type == pygame.KEYDOWN:
+                    if event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+                        return True
+                    elif event.key == pygame.K_ESCAPE:
+                        return False
+
+
+    def ask_value(prompt, value):
+        """Ask the user to type a number. Return value if nothing valid is typed."""
+        text = ""
+
+        while True:
+            for event in [pygame.event.wait()] + pygame.event.get():
+                if event.type == pygame.QUIT:
+                    raise QuitEvent("quit event during value input")
+
+                elif event.type == pygame.KEYDOWN:
+                    if event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+                        try:
+                            return float(text)
+                        except ValueError:
+                            return value
+                    elif event.key == pygame.K_ESCAPE:
+                        return value
+                    elif event.key == pygame.K_BACKSPACE:
+                        text = text[:-1]
+                    elif event.unicode and event.unicode in "0123456789.-+eE":
+                        text += event.unicode
+
+            text_string = prompt + " (" + str(value) + "): " + text
+            text_Rect = default_font.get_rect(text_string)
+            prompt_Rect = pygame.Rect(0, screen.get_height() - text_Rect.height, screen.get_width(), text_Rect.height)
+            pygame.draw.rect(screen, (100, 100, 100), prompt_Rect)
+            default_font.render_to(screen, prompt_Rect.topleft, text_string, (255, 255, 255))
+            pygame.display.update(prompt_Rect)
+
+
+    def ask_axis_values(axis_no):
+        """Ask the user for the data values at the start and the end of an axis."""
+        name = "XY"[axis_no]
+        start_value = ask_value(name + "-axis value at its start", axes_value[axis_no][0])
+        end_value = ask_value(name + "-axis value at its end", axes_value[axis_no][1])
+        return [start_value, end_value]
+
+
+    def draw_marker(surface, zoom_factor, screen_gcoord, coord, col, marker_size, marker_type, width=0, position=False):
         """Draw a data marker on the screen."""
 
         # If position==True, screen position is passed instead of gcoord.
         if not position:
-            center_pos = pygame.Vector2(gcoord_to_pos(coord, zoom_factor, screen_gcoord))
+            center_pos = gcoord_to_pos(coord, zoom_factor, screen_gcoord)
         else:
             center_pos = pygame.Vector2(coord) - pygame.Vector2(1,1)*marker_size*zoom_factor
             
-        marker_surface = draw_single_marker_surface(marker_size, zoom_factor, marker_type, center_pos, col, width)
-        #screen.blit(marker_surface, (0,0))
-        
-        
+        marker_sprites.draw(surface, numpy.array([center_pos]), marker_type, marker_size, zoom_factor, col, width)
 
-    def draw_data_markers(seriesNo_itemNo, zoom_factor, screen_gcoord, interface_mode=mode.normal):
-        """Plot all the data series on the screen.
-        Higher transparency in edit mode, except for the current data series.        
-        """
 
-        s = pygame.Surface((screen.get_width(),screen.get_height()), pygame.SRCALPHA)
-        col = pygame.Color(0,0,0,0)
+    def marker_rect(coord, marker_size):
+        """Return the rectangle of the screen covered by a marker and its edit indicator."""
+        half_size = (marker_size + 3) * zoom_factor + 2
+        center_pos = gcoord_to_pos(coord, zoom_factor, screen_gcoord)
+        return pygame.Rect(math.floor(center_pos[0] - half_size), math.floor(center_pos[1] - half_size),
+                           math.ceil(2 * half_size) + 1, math.ceil(2 * half_size) + 1)
 
-        seriesNo, _ = seriesNo_itemNo
-        
-        for i, series_coord in enumerate(data_gcoord):
-            alpha = 70
-            if interface_mode == mode.edit and i != seriesNo: alpha = 30
 
-            col.hsva = (i*350/len(data_gcoord), 90, 90, alpha)   # Change marker color according to the series.
-            for coord in series_coord:
-                draw_marker(screen, zoom_factor, screen_gcoord, coord, col, series_marker_size[i], series_marker_shape[i])
+    def point_rect(seriesNo, itemNo):
+        """Return the rectangle of the screen covered by a data point, or None if it does not exist."""
+        if not 0 <= itemNo < len(data_gcoord[seriesNo]):
+            return None
+        return marker_rect(data_gcoord[seriesNo][itemNo], series_marker_size[seriesNo])
 
-        return
 
-
-    def draw_markers_overlay(seriesNo_itemNo, zoom_factor, screen_gcoord):
+    def draw_markers_overlay(surface, seriesNo_itemNo, zoom_factor, screen_gcoord):
         """In edit mode, draw an indicator over the edited data point."""
         
         seriesNo, itemNo = seriesNo_itemNo
-        s = pygame.Surface((screen.get_width(),screen.get_height()), pygame.SRCALPHA)
 
         if data_gcoord[seriesNo]:
             coord = data_gcoord[seriesNo][itemNo]
-            draw_marker(s, zoom_factor, screen_gcoord, coord, "black", series_marker_size[seriesNo] + 3, series_marker_shape[seriesNo], width = 1)
-
-        screen.blit(s, (0,0))
-        return
-
-
-    def draw_axes(zoom_factor, screen_gcoord):
-        """Draw the axes."""
-        for axis_coord in axes_gcoord:
-            pygame.draw.line(screen,
-                            "red",
-                            gcoord_to_pos(axis_coord[0], zoom_factor, screen_gcoord),
-                            gcoord_to_pos(axis_coord[1], zoom_factor, screen_gcoord))
+            draw_marker(surface, zoom_factor, screen_gcoord, coord, "black", series_marker_size[seriesNo] + 3, series_marker_shape[seriesNo], width = 1)
         return
 
 
-    def draw_mouse_overlay(zoom_factor, marker_size, marker_shape):
-        """Draw a marker under the cursor of the mouse."""
+    def draw_mouse_overlay(surface, zoom_factor, marker_size, marker_shape):
+        """Draw a marker under the cursor of the mouse and return the rectangle it covers."""
         col = pygame.Color(0,0,0,0)
         col.hsva = (working_series*350/len(data_gcoord), 100, 100, 50)   # Change marker color according to the series.
 
         pos = pygame.mouse.get_pos()
-        coord = pos_to_gcoord(pos, zoom_factor, screen_gcoord)
-
-        draw_marker(screen, zoom_factor, screen_gcoord, coord, col, marker_size, marker_shape)
-        return
-
+        coord = snapped(pos_to_gcoord(pos, zoom_factor, screen_gcoord))
 
-    def compute_coords():
-        """Compute data x and y values based on their coordinates and the axes."""
-        x_axis_start_gcoord, x_axis_end_gcoord = axes_gcoord[0]
-        y_axis_start_gcoord, y_axis_end_gcoord = axes_gcoord[1]
-
-        data_coord[:] = []
-
-        
-        
-        for series_gcoord, marker_size in zip(data_gcoord, series_marker_size):
-            data_array = numpy.zeros((len(series_gcoord), 4))
-            for i, gcoord in enumerate(series_gcoord):
-                x_gcoord, y_gcoord = gcoord
-                data_array[i, 0] = (x_gcoord - x_axis_start_gcoord[0]) / (x_axis_end_gcoord[0] - x_axis_start_gcoord[0])
-                data_array[i, 2] = (y_gcoord - y_axis_start_gcoord[1]) / (y_axis_end_gcoord[1] - y_axis_start_gcoord[1])
-                data_array[i, 1] = max(1.0, marker_size * zoom_factor) / (x_axis_end_gcoord[0] - x_axis_start_gcoord[0])
-                data_array[i, 3] = -max(1.0, marker_size * zoom_factor) / (y_axis_end_gcoord[1] - y_axis_start_gcoord[1])
-            data_coord.append(data_array)
-        
-        return
-
-
-    def export_data():
-        """Export data x and y values in a file."""
-        for i, data_array in enumerate(data_coord):
-            numpy.savetxt(filename + "_" + str(i) + ".csv", data_array[data_array[:, 0].argsort()], delimiter='\t', comments='', fmt='%1.7f', header="X\t+-\tY\t+-")
+        draw_marker(surface, zoom_factor, screen_gcoord, coord, col, marker_size, marker_shape)
+        return marker_rect(coord, marker_size)
 
 
     def save():
-        """Save the working environment."""
-        chest = [data_gcoord, axes_gcoord, series_marker_size, series_marker_shape]
-        with open(filename + ".etp", "wb") as fp:
-            pickle.dump(chest, fp)
-
+        """Save the working environment in the background."""
+        with profiler.section("save"):
+            autosaver.request(chest, journal)
 
-    def draw_controls_overlay(interface_mode, display_controls):
-        """Display the controls."""
-
-        default_font = pygame.freetype.SysFont(None, 16)
-        default_font.antialiased = True
 
+    def controls_text(interface_mode):
+        """Return the name of the mode and the lines of help text for its controls."""
         if interface_mode == mode.normal:
             text_string_a = "E: EDIT mode   M: marker shape   Mouse Wheel: marker size   Left click: Add marker   Right click: remove last marker"
-            text_string_b = "CTRL+Wheel: zoom   Arrows: Move view   SPACE: reset view   S: save   C: compute and export data"
-            text_string_c = "RETURN: add a new series of data   P: previous series   N: next series"
-            text_string_d = "H: hide/show controls   X or Y: set X- or Y- axis"
-
-            text_strings = [text_string_a, text_string_b, text_string_c, text_string_d]
-            text_origin = screen.get_height()
-            text_mode_Rect = default_font.get_rect("NORMAL") # Top origin of the text
-            text_origin -= text_mode_Rect.height
-            
-            s = pygame.Surface((screen.get_width(),screen.get_height()), pygame.SRCALPHA)
-            pygame.draw.rect(s,
-                             (100, 100, 100),
-                             pygame.Rect(0, text_origin, screen.get_width(), text_mode_Rect.height))
-            default_font.render_to(s, (0, text_origin), "NORMAL", (255, 255, 255)).height
-            if display_controls:
-                for text_string in text_strings:
-                    text_origin -= default_font.get_rect(text_string).height
-                    default_font.render_to(s, (0, text_origin), text_string, (0, 0, 0), bgcolor= (255, 255, 255, 200)).height
-                
-            screen.blit(s, (0,0))
+            text_string_b = "CTRL+Wheel: zoom   Arrows: Move view   SPACE: reset view   S: save   C: compute and export data   CTRL+Z: undo   CTRL+SHIFT+Z: redo"
+            text_string_c = "RETURN: add a new series of data   P: previous series   N: next series   T: trace the color under the mouse in a region   PAGEUP/PAGEDOWN: previous/next image"
+            text_string_d = "H: hide/show controls   F3: frame timings   X or Y (+ALT: tilted): set X- or Y- axis   F: find the axes   SHIFT+X or SHIFT+Y: axis scale   CTRL+X or CTRL+Y: axis values"
+            text_string_e = "G: snap the markers on the image   SHIFT+G: snap all the markers of the series"
+
+            axes_string = "   ".join(name + ": " + scale.name.replace("_", " ") + " " + str(start_value) + " to " + str(end_value)
+                                     for name, scale, (start_value, end_value) in zip("XY", axes_scale, axes_value))
+            mode_string = "NORMAL   SNAP   " if snap_enabled else "NORMAL   "
+            if snap_pending:
+                mode_string += "SNAPPING...   "
+            return mode_string + axes_string, [text_string_a, text_string_b, text_string_c, text_string_d, text_string_e]
             
         elif interface_mode == mode.edit:
-            text_string_a = "ESCAPE: NORMAL mode   LEFT (+SHIFT): previous data point   RIGHT (+SHIFT): next data point   HOME: first data point   END: last data point"
+            text_string_a = "ESCAPE: NORMAL mode   Left click: closest data point   LEFT (+SHIFT): previous data point   RIGHT (+SHIFT): next data point   HOME: first data point   END: last data point"
             text_string_b = "CTRL+Wheel: zoom   WASD: Move data point   WASD+ALT: Move series"
             text_string_c = "SHIFT+HOME: first series   SHIFT+END: last series"
             text_string_d = "SUPPR: Remove data point   SHIFT+SUPPR: Remove data series   DOWN (+SHIFT): next series   UP (+SHIFT): previous series"
-            text_string_e = "H: hide/show controls"
+            text_string_e = "H: hide/show controls   F3: frame timings   CTRL+Z: undo   CTRL+SHIFT+Z: redo"
 
-            text_strings = [text_string_a, text_string_b, text_string_c, text_string_d, text_string_e]
-            text_origin = screen.get_height()
-            text_mode_Rect = default_font.get_rect("EDIT") # Top origin of the text
-            text_origin -= text_mode_Rect.height
-            
-            s = pygame.Surface((screen.get_width(),screen.get_height()), pygame.SRCALPHA)
-            pygame.draw.rect(s,
-                             (100, 100, 100),
-                             pygame.Rect(0, text_origin, screen.get_width(), text_mode_Rect.height))
-            default_font.render_to(s, (0, text_origin), "EDIT", (255, 255, 255)).height
+            return "EDIT", [text_string_a, text_string_b, text_string_c, text_string_d, text_string_e]
+
+
+    def controls_panel(width, interface_mode, display_controls):
+        """Return the surface of the controls, rendered once for each text and width."""
+        mode_string, text_strings = controls_text(interface_mode)
+        key = (mode_string, display_controls, width)
+        if key not in controls_panels:
+            if len(controls_panels) > 8:    # Panels of older axes settings or window sizes.
+                controls_panels.clear()
+            lines = [(mode_string, (255, 255, 255), (100, 100, 100))]
             if display_controls:
-                for text_string in text_strings:
-                    text_origin -= default_font.get_rect(text_string).height
-                    default_font.render_to(s, (0, text_origin), text_string, (0, 0, 0), bgcolor= (255, 255, 255, 200)).height
-                
-            screen.blit(s, (0,0))
+                lines += [(text_string, (0, 0, 0), (255, 255, 255, 200)) for text_string in text_strings]
+            heights = [default_font.get_rect(text_string).height for text_string, _, _ in lines]
+            panel = pygame.Surface((width, sum(heights)), pygame.SRCALPHA)
+            pygame.draw.rect(panel, (100, 100, 100), pygame.Rect(0, panel.get_height() - heights[0], width, heights[0]))
+            text_origin = panel.get_height()
+            for (text_string, col, bgcolor), height in zip(lines, heights):
+                text_origin -= height
+                default_font.render_to(panel, (0, text_origin), text_string, col, bgcolor=bgcolor)
+            controls_panels[key] = panel
+        return controls_panels[key]
 
 
-    def update_screen():
-        """Update the screen."""
-        
-        screen.fill("grey")
-        sized_graph = pygame.transform.scale_by(asurf, zoom_factor)
-        screen.blit(sized_graph, gcoord_to_pos((0,0), zoom_factor, screen_gcoord))
-        draw_axes(zoom_factor, screen_gcoord)
-        draw_data_markers(edit_seriesNo_itemNo, zoom_factor, screen_gcoord, interface_mode)
+    def controls_rect(surface, interface_mode, display_controls):
+        """Return the rectangle covered by the controls."""
+        panel = controls_panel(surface.get_width(), interface_mode, display_controls)
+        return panel.get_rect(bottomleft=(0, surface.get_height()))
+
+
+    def draw_controls_overlay(surface, interface_mode, display_controls):
+        """Display the controls."""
+        panel = controls_panel(surface.get_width(), interface_mode, display_controls)
+        surface.blit(panel, panel.get_rect(bottomleft=(0, surface.get_height())))
+
 
+    def prepare_scene(rects):
+        """Update the layers of the series before the damaged rectangles are drawn."""
+        edited_seriesNo = edit_seriesNo_itemNo[0] if interface_mode == mode.edit else None
+        plot_scene.prepare(rects, PlotScene.alphas(len(data_gcoord), edited_seriesNo), zoom_factor, screen_gcoord, screen.get_size())
+
+
+    def draw_scene(surface):
+        """Draw everything but the mouse overlay."""
+        plot_scene.draw(surface, zoom_factor, screen_gcoord)
         if interface_mode == mode.edit:
-            draw_markers_overlay(edit_seriesNo_itemNo, zoom_factor, screen_gcoord)
-        else:
-            draw_mouse_overlay(zoom_factor, series_marker_size[working_series], series_marker_shape[working_series])
-            pass
-        draw_controls_overlay(interface_mode, display_controls)
+            with profiler.section("overlay"):
+                draw_markers_overlay(surface, edit_seriesNo_itemNo, zoom_factor, screen_gcoord)
+        with profiler.section("text"):
+            draw_controls_overlay(surface, interface_mode, display_controls)
+
+
+    def draw_hud(surface):
+        """Draw the frame rate and the mean durations of the stages, and return the rectangle they cover."""
+        lines = ["%.1f FPS" % profiler.fps()]
+        lines += ["%s: %.2f ms" % (name, mean * 1000) for name, mean in profiler.means().items()]
+        line_height = default_font.get_sized_height()
+        hud_rect = pygame.Rect(0, 0, 0, 0)
+        for line_no, text_string in enumerate(lines):
+            hud_rect.union_ip(default_font.render_to(surface, (0, line_no * line_height), text_string, (255, 255, 255), bgcolor=(0, 0, 0)))
+        return hud_rect
+
 
-        pygame.display.flip()
+    def draw_cursor(surface):
+        """Draw the mouse overlay in normal mode, and the frame timings."""
+        rects = []
+        if interface_mode == mode.normal and pygame.mouse.get_focused():
+            rects.append(draw_mouse_overlay(surface, zoom_factor, series_marker_size[working_series], series_marker_shape[working_series]))
+        if display_hud:
+            rects.append(draw_hud(surface))
+        return rects[0].unionall(rects[1:]) if rects else None
+
+
+    def set_axes(detected_axes):
+        """Replace both axes."""
+        for axis_no, axis_gcoord in enumerate(detected_axes):
+            for end, (x, y) in enumerate(axis_gcoord):
+                edit(operation.set_axis_point, axis_no, end, x, y)
 
 
     interface_mode = mode.normal
     display_controls = True
+    display_hud = False
+    snap_enabled = snap
+    snap_thread = build_snap_map() if snap else None
+    renderer = DirtyRenderer(screen, draw_scene, draw_cursor, profiler, prepare_scene)
+
+    if session_version(filename + ".etp") == 0:    # Rewrite older pickled sessions, keeping the original.
+        shutil.copy2(filename + ".etp", filename + ".etp.legacy")
+        save_session(filename, chest, journal)
+
+    # Without a journal the session file, or the absence of one, is up to date: an image only opened is not saved.
+    saved = not os.path.exists(journal.path)
+    autosaver = Autosaver(filename, journal.seq if saved else None, autosave_edits, autosave_seconds)
+    pygame.time.set_timer(AUTOSAVE_TICK, int(autosave_seconds * 1000))
+
+    if running:     # The first frame, without waiting for an event.
+        renderer.render()
+        profiler.frame()
+    if startup is not None:     # Before the detected axes are confirmed, which waits for the user.
+        startup.add("setup", setup_start, time.perf_counter())
+        startup.print()
+
+    if running and auto_axes and not os.path.exists(filename + ".etp"):
+        try:
+            detected_axes = find_axes()
+            if confirm_axes(detected_axes):
+                set_axes(detected_axes)
+            renderer.damage()   # The confirmation was drawn over the window.
+            renderer.render()
+        except QuitEvent:
+            running = False
 
     while running:
 
-        for event in pygame.event.get():
+        events = [pygame.event.wait()] + pygame.event.get()   # Sleep while idle, then handle the whole burst at once.
+        events_start = time.perf_counter()
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
             
-            if event.type == pygame.MOUSEMOTION:    # Drop all mouse motion events
-                continue
-            
+            if event.type == pygame.MOUSEMOTION:    # Only the mouse overlay follows the mouse.
+                renderer.damage_cursor()
+
+            elif event.type == pygame.VIDEORESIZE:
+                renderer.resize()
+
+            elif event.type in (pygame.WINDOWEXPOSED, IMAGE_READY):
+                renderer.damage()
+
+            elif event.type == SNAP_MAP_READY and snap_maps and event.snap_map is snap_maps[0]:
+                # Snap the series waiting for it, not for the map of a previous image built meanwhile.
+                for seriesNo, series_gcoord in enumerate(data_gcoord):  # Unless deleted meanwhile.
+                    if any(series_gcoord is pending for pending in snap_pending):
+                        snap_series(seriesNo)
+                snap_pending.clear()
+                renderer.damage()
+
+            elif event.type == pygame.WINDOWLEAVE:
+                renderer.damage_cursor()
             
             elif event.type == pygame.MOUSEWHEEL:
+                renderer.damage()
                 if pygame.key.get_pressed()[pygame.K_LCTRL] or pygame.key.get_pressed()[pygame.K_RCTRL]:
                     zoom_factor = max(0, zoom_factor + event.y*0.1)
                 else:
                     if interface_mode == mode.normal:
-                        series_marker_size[working_series] = max(1, series_marker_size[working_series] + event.y)
+                        edit(operation.set_marker_size, working_series, x=max(1, series_marker_size[working_series] + event.y))
                     elif interface_mode == mode.edit:
-                        series_marker_size[edit_seriesNo_itemNo[0]] = max(1, series_marker_size[edit_seriesNo_itemNo[0]] + event.y)
+                        edit(operation.set_marker_size, edit_seriesNo_itemNo[0], x=max(1, series_marker_size[edit_seriesNo_itemNo[0]] + event.y))
 
 
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -427,56 +2829,84 @@ def analyze_picture(filename):
                     pos = pygame.mouse.get_pos()
 
                     if interface_mode == mode.normal:
-                        data_gcoord[working_series].append(pos_to_gcoord(pos, zoom_factor, screen_gcoord))
+                        edit(operation.append_point, working_series, 0, *snapped(pos_to_gcoord(pos, zoom_factor, screen_gcoord)))
+                        renderer.damage(point_rect(working_series, len(data_gcoord[working_series]) - 1))
+
+                    elif interface_mode == mode.edit:   # Select the closest data point.
+                        gcoord = pos_to_gcoord(pos, zoom_factor, screen_gcoord)
+                        closest = None
+                        for seriesNo, series_gcoord in enumerate(data_gcoord):
+                            itemNo = series_gcoord.nearest(gcoord)
+                            if itemNo is not None:
+                                distance = math.dist(series_gcoord[itemNo], gcoord)
+                                if closest is None or distance < closest[0]:
+                                    closest = (distance, seriesNo, itemNo)
+                        if closest is not None:
+                            if closest[1] == edit_seriesNo_itemNo[0]:
+                                renderer.damage(point_rect(*edit_seriesNo_itemNo), point_rect(*closest[1:]))
+                            else:
+                                renderer.damage()
+                            edit_seriesNo_itemNo = list(closest[1:])
                     
                 
                 elif event.button == 3: # Right click
                     if interface_mode == mode.normal:
-                        if len(data_gcoord[working_series]) > 0 : data_gcoord[working_series].pop(-1)
+                        if len(data_gcoord[working_series]) > 0 :
+                            renderer.damage(point_rect(working_series, len(data_gcoord[working_series]) - 1))
+                            edit(operation.pop_point, working_series, -1)
                 
 
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_e:
                     interface_mode = mode.edit
+                    renderer.damage()
 
                 elif event.key == pygame.K_ESCAPE:
                     interface_mode = mode.normal
                     working_series = 0
+                    renderer.damage()
 
                 elif event.key == pygame.K_RETURN:   # Add a series
                     if interface_mode == mode.normal:
-                        data_gcoord.append([])
-                        series_marker_size.append(marker_size)
-                        series_marker_shape.append(marker.circle)
+                        edit(operation.add_series, index=marker.circle, x=marker_size)
                         working_series = len(data_gcoord) - 1
+                        renderer.damage()   # The colors of all the series change.
 
                 elif event.key == pygame.K_n:   # Next series
                     if interface_mode == mode.normal:
                         working_series = (working_series + 1) % len(data_gcoord)
+                        renderer.damage_cursor()
 
                 elif event.key == pygame.K_p:   # Prev series
                     if interface_mode == mode.normal:
                         working_series = (working_series - 1) % len(data_gcoord)
+                        renderer.damage_cursor()
                 
                 elif event.key == pygame.K_m:   # Marker shape
                     if interface_mode == mode.normal:
-                        series_marker_shape[working_series] = 1 + ((series_marker_shape[working_series]) % len(marker))
+                        edit(operation.set_marker_shape, working_series, 1 + ((series_marker_shape[working_series]) % len(marker)))
+                        renderer.damage()
                         
-                elif event.key == pygame.K_x:   # Set x-axis
-                    try:
-                        start_coord, stop_coord = ask_axis(axis_type.x, zoom_factor, screen_gcoord)
-                        axes_gcoord[0] = [start_coord, stop_coord]
-                    except QuitEvent:
-                        running = False
-
-                elif event.key == pygame.K_y:   # Set y-axis
+                elif event.key in (pygame.K_x, pygame.K_y):   # Set an axis
+                    axis_no = 0 if event.key == pygame.K_x else 1
                     try:
-                        start_coord, stop_coord = ask_axis(axis_type.y, zoom_factor, screen_gcoord)
-                        axes_gcoord[1] = [start_coord, stop_coord]
+                        if event.mod & pygame.KMOD_SHIFT:   # Next scale
+                            edit(operation.set_axis_scale, axis_no, axes_scale[axis_no].value % len(axis_scale) + 1)
+                            if axes_scale[axis_no] in (axis_scale.log, axis_scale.log_reversed) and min(axes_value[axis_no]) <= 0:
+                                edit(operation.set_axis_value, axis_no, 0, 1.0)
+                                edit(operation.set_axis_value, axis_no, 1, 10.0)
+                        elif event.mod & pygame.KMOD_CTRL:
+                            for end, value in enumerate(ask_axis_values(axis_no)):
+                                edit(operation.set_axis_value, axis_no, end, value)
+                        else:
+                            for end, gcoord in enumerate(ask_axis(axis_type.x if axis_no == 0 else axis_type.y, zoom_factor, screen_gcoord)):
+                                edit(operation.set_axis_point, axis_no, end, *gcoord)
                     except QuitEvent:
                         running = False
+                    renderer.damage()
 
                 elif event.key == pygame.K_UP:
+                    renderer.damage()
                     if interface_mode == mode.normal:
                         screen_gcoord = (screen_gcoord[0], screen_gcoord[1] - 100 * zoom_factor)
                     elif interface_mode == mode.edit:
@@ -486,6 +2916,7 @@ def analyze_picture(filename):
                         edit_seriesNo_itemNo = [(edit_seriesNo_itemNo[0] - step) % len(data_gcoord), 0]
 
                 elif event.key == pygame.K_DOWN:
+                    renderer.damage()
                     if interface_mode == mode.normal:
                         screen_gcoord = (screen_gcoord[0], screen_gcoord[1] + 100 * zoom_factor)
                     elif interface_mode == mode.edit:
@@ -497,120 +2928,278 @@ def analyze_picture(filename):
                 elif event.key == pygame.K_RIGHT:
                     if interface_mode == mode.normal:
                         screen_gcoord = (screen_gcoord[0] + 100 * zoom_factor, screen_gcoord[1])
+                        renderer.damage()
                     elif interface_mode == mode.edit:
                         if data_gcoord[edit_seriesNo_itemNo[0]]:
                             step = 1
                             if pygame.key.get_pressed()[pygame.K_RSHIFT] or pygame.key.get_pressed()[pygame.K_LSHIFT]:
                                 step = 10
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
                             edit_seriesNo_itemNo[1] = (edit_seriesNo_itemNo[1] + step) % len(data_gcoord[edit_seriesNo_itemNo[0]])
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
 
                 elif event.key == pygame.K_LEFT:
                     if interface_mode == mode.normal:
                         screen_gcoord = (screen_gcoord[0] - 100 * zoom_factor, screen_gcoord[1])
+                        renderer.damage()
                     elif interface_mode == mode.edit:
                         if data_gcoord[edit_seriesNo_itemNo[0]]:
                             step = 1
                             if pygame.key.get_pressed()[pygame.K_RSHIFT] or pygame.key.get_pressed()[pygame.K_LSHIFT]:
                                 step = 10
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
                             edit_seriesNo_itemNo[1] = (edit_seriesNo_itemNo[1] - step) % len(data_gcoord[edit_seriesNo_itemNo[0]])
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
                 
                 elif event.key == pygame.K_HOME:
                     if interface_mode == mode.edit:
                         if pygame.key.get_pressed()[pygame.K_RSHIFT] or pygame.key.get_pressed()[pygame.K_LSHIFT]:
                             edit_seriesNo_itemNo[0] = 0
+                            renderer.damage()
                         else:
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
                             edit_seriesNo_itemNo[1] = 0
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
 
                 elif event.key == pygame.K_END:
                     if interface_mode == mode.edit:
                         if pygame.key.get_pressed()[pygame.K_RSHIFT] or pygame.key.get_pressed()[pygame.K_LSHIFT]:
                             edit_seriesNo_itemNo[0] = len(data_gcoord) - 1
+                            renderer.damage()
                         else:
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
                             edit_seriesNo_itemNo[1] = len(data_gcoord[edit_seriesNo_itemNo[0]]) - 1
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
 
                 elif event.key == pygame.K_SPACE:
                     if interface_mode == mode.normal:
                         screen_gcoord = (0,0)
                         zoom_factor = 1.0
+                        renderer.damage()
                         
                 elif event.key == pygame.K_w:
                     if interface_mode == mode.edit:
                         if pygame.key.get_pressed()[pygame.K_LALT]:
-                            for data_no, (x_gcoord, y_gcoord) in enumerate(data_gcoord[edit_seriesNo_itemNo[0]]):
-                                data_gcoord[edit_seriesNo_itemNo[0]][data_no] = (x_gcoord, y_gcoord - 1)
-                        else:
-                            x_gcoord, y_gcoord = data_gcoord[edit_seriesNo_itemNo[0]][edit_seriesNo_itemNo[1]]
-                            data_gcoord[edit_seriesNo_itemNo[0]][edit_seriesNo_itemNo[1]] = (x_gcoord, y_gcoord - 1)
+                            edit(operation.translate_series, edit_seriesNo_itemNo[0], 0, 0, -1)
+                            renderer.damage()
+                        elif data_gcoord[edit_seriesNo_itemNo[0]]:
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
+                            edit(operation.move_point, *edit_seriesNo_itemNo, 0, -1)
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
 
                 elif event.key == pygame.K_s:
                     if interface_mode == mode.edit:
                         if pygame.key.get_pressed()[pygame.K_LALT]:
-                            for data_no, (x_gcoord, y_gcoord) in enumerate(data_gcoord[edit_seriesNo_itemNo[0]]):
-                                data_gcoord[edit_seriesNo_itemNo[0]][data_no] = (x_gcoord, y_gcoord + 1)
-                        else:
-                            x_gcoord, y_gcoord = data_gcoord[edit_seriesNo_itemNo[0]][edit_seriesNo_itemNo[1]]
-                            data_gcoord[edit_seriesNo_itemNo[0]][edit_seriesNo_itemNo[1]] = (x_gcoord, y_gcoord + 1)
+                            edit(operation.translate_series, edit_seriesNo_itemNo[0], 0, 0, 1)
+                            renderer.damage()
+                        elif data_gcoord[edit_seriesNo_itemNo[0]]:
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
+                            edit(operation.move_point, *edit_seriesNo_itemNo, 0, 1)
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
                     elif interface_mode == mode.normal:
                         save()
 
                 elif event.key == pygame.K_a:
                     if interface_mode == mode.edit:
                         if pygame.key.get_pressed()[pygame.K_LALT]:
-                            for data_no, (x_gcoord, y_gcoord) in enumerate(data_gcoord[edit_seriesNo_itemNo[0]]):
-                                data_gcoord[edit_seriesNo_itemNo[0]][data_no] = (x_gcoord - 1, y_gcoord)
-                        else:
-                            x_gcoord, y_gcoord = data_gcoord[edit_seriesNo_itemNo[0]][edit_seriesNo_itemNo[1]]
-                            data_gcoord[edit_seriesNo_itemNo[0]][edit_seriesNo_itemNo[1]] = (x_gcoord - 1, y_gcoord)
+                            edit(operation.translate_series, edit_seriesNo_itemNo[0], 0, -1, 0)
+                            renderer.damage()
+                        elif data_gcoord[edit_seriesNo_itemNo[0]]:
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
+                            edit(operation.move_point, *edit_seriesNo_itemNo, -1, 0)
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
 
                 elif event.key == pygame.K_d:
                     if interface_mode == mode.edit:
                         if pygame.key.get_pressed()[pygame.K_LALT]:
-                            for data_no, (x_gcoord, y_gcoord) in enumerate(data_gcoord[edit_seriesNo_itemNo[0]]):
-                                data_gcoord[edit_seriesNo_itemNo[0]][data_no] = (x_gcoord + 1, y_gcoord)
-                        else:
-                            x_gcoord, y_gcoord = data_gcoord[edit_seriesNo_itemNo[0]][edit_seriesNo_itemNo[1]]
-                            data_gcoord[edit_seriesNo_itemNo[0]][edit_seriesNo_itemNo[1]] = (x_gcoord + 1, y_gcoord)
+                            edit(operation.translate_series, edit_seriesNo_itemNo[0], 0, 1, 0)
+                            renderer.damage()
+                        elif data_gcoord[edit_seriesNo_itemNo[0]]:
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
+                            edit(operation.move_point, *edit_seriesNo_itemNo, 1, 0)
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
 
                 elif event.key == pygame.K_DELETE:
                     if interface_mode == mode.edit:
                         if pygame.key.get_pressed()[pygame.K_RSHIFT] or pygame.key.get_pressed()[pygame.K_LSHIFT]: # Remove the whole series
-                            if len(data_gcoord) > 1:
-                                data_gcoord.pop(edit_seriesNo_itemNo[0])
-                                edit_seriesNo_itemNo[0] = max(0, edit_seriesNo_itemNo[0] - 1)
-                                edit_seriesNo_itemNo[1] = 0
-                            else:
-                                data_gcoord[0] = []
-                                edit_seriesNo_itemNo[0]
-                                edit_seriesNo_itemNo[1] = 0
+                            edit(operation.delete_series, edit_seriesNo_itemNo[0])
+                            edit_seriesNo_itemNo[0] = min(max(0, edit_seriesNo_itemNo[0] - 1), len(data_gcoord) - 1)
+                            edit_seriesNo_itemNo[1] = 0
+                            working_series = min(working_series, len(data_gcoord) - 1)
+                            renderer.damage()
                         elif len(data_gcoord[edit_seriesNo_itemNo[0]]) > 0:   # Remove this element from the series.
-                            data_gcoord[edit_seriesNo_itemNo[0]].pop(edit_seriesNo_itemNo[1])
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
+                            edit(operation.pop_point, *edit_seriesNo_itemNo)
                             edit_seriesNo_itemNo[1] = max(0, edit_seriesNo_itemNo[1] - 1)
+                            renderer.damage(point_rect(*edit_seriesNo_itemNo))
                             
                 elif event.key == pygame.K_c:   # Compute actual coordinates with the axes.
                     if interface_mode == mode.normal:
-                        compute_coords()
-                        export_data()
+                        try:
+                            with profiler.section("compute"):
+                                data_coord = compute_coords(data_gcoord, axes_gcoord, axes_scale, axes_value, series_marker_size, zoom_factor)
+                        except ValueError as error:
+                            print("Can not compute the data:", error)
+                        else:
+                            with profiler.section("export"):
+                                export_data(filename, data_coord)
+
+                elif event.key == pygame.K_f:   # Find the axes
+                    if interface_mode == mode.normal:
+                        try:
+                            detected_axes = find_axes()
+                            if confirm_axes(detected_axes):
+                                set_axes(detected_axes)
+                        except QuitEvent:
+                            running = False
+                        renderer.damage()
+
+                elif event.key == pygame.K_t:   # Trace a curve
+                    if interface_mode == mode.normal:
+                        gcoord = pos_to_gcoord(pygame.mouse.get_pos(), zoom_factor, screen_gcoord)
+                        if asurf.get_rect().collidepoint(gcoord):
+                            try:
+                                points = auto_trace(asurf.get_at((int(gcoord[0]), int(gcoord[1]))))
+                            except QuitEvent:
+                                running = False
+                            else:
+                                if points is not None and len(points):
+                                    edit(operation.add_series, index=marker.circle, x=marker_size)
+                                    working_series = len(data_gcoord) - 1
+                                    edits = numpy.zeros(len(points), dtype=EDIT_DTYPE)
+                                    edits["op"] = operation.append_point
+                                    edits["series"] = working_series
+                                    edits["x"], edits["y"] = points[:, 0], points[:, 1]
+                                    edit_many(edits)
+                            renderer.damage()
+
+                elif event.key == pygame.K_z:   # Undo, or redo with SHIFT
+                    if event.mod & pygame.KMOD_CTRL:
+                        edits = undo_log.redo() if event.mod & pygame.KMOD_SHIFT else undo_log.undo()
+                        if edits is not None:
+                            apply_edits(chest, edits)
+                            journal.extend(edits)
+                            working_series = min(working_series, len(data_gcoord) - 1)
+                            edit_seriesNo_itemNo[0] = min(edit_seriesNo_itemNo[0], len(data_gcoord) - 1)
+                            edit_seriesNo_itemNo[1] = max(0, min(edit_seriesNo_itemNo[1], len(data_gcoord[edit_seriesNo_itemNo[0]]) - 1))
+                            renderer.damage()
+
+                elif event.key == pygame.K_g:   # Snap mode, or snap the points of the series with SHIFT
+                    if snap_thread is None:
+                        snap_thread = build_snap_map()
+                    if event.mod & pygame.KMOD_SHIFT:
+                        if interface_mode == mode.normal and snap_maps:
+                            snap_series(working_series)
+                            renderer.damage()
+                        elif interface_mode == mode.normal:     # Snapped once the snap map is built.
+                            snap_pending.append(data_gcoord[working_series])
+                            renderer.damage(controls_rect(screen, interface_mode, display_controls))
+                    else:
+                        renderer.damage(controls_rect(screen, interface_mode, display_controls))
+                        snap_enabled = not snap_enabled
+                        renderer.damage(controls_rect(screen, interface_mode, display_controls))
+                        renderer.damage_cursor()
 
                 elif event.key == pygame.K_h:
+                    renderer.damage(controls_rect(screen, interface_mode, True))
                     display_controls = not display_controls
 
-            if running and event.type != pygame.MOUSEMOTION:    # Don't draw all the screen each time the mouse is moved.
-                update_screen()
-
-
-        dt = clock.tick(60) / 1000
-        update_screen() # Draw the screen to take into account the new position of the mouse.
-
-    pygame.quit()
-
+                elif event.key == pygame.K_F3:
+                    display_hud = not display_hud
+                    renderer.damage_cursor()
 
+                elif event.key in (pygame.K_PAGEUP, pygame.K_PAGEDOWN):   # Previous or next image
+                    step = 1 if event.key == pygame.K_PAGEDOWN else -1
+                    if 0 <= position[0] + step < position[1]:
+                        next_step = step
+                        running = False
 
+            undo_log.commit()   # The edits of one event are undone together.
+
+        if autosaver.due(journal):
+            save()
+        journal.truncate(autosaver.saved_seq)   # Once the edits are written.
+        profiler.add("events", events_start, time.perf_counter())
+
+        if running and renderer.pending():
+            if display_hud:
+                renderer.damage_cursor()    # The timings change with every frame.
+            renderer.render()   # Draw once for the whole burst of events.
+            profiler.frame()
+
+    pygame.time.set_timer(AUTOSAVE_TICK, 0)
+    save()
+    autosaver.close()
+    journal.truncate(autosaver.saved_seq)
+    journal.close()
+    for name, (count, mean, longest) in autosaver.stats().items():
+        if count:
+            print("Autosave %s: %d, %.1f ms mean, %.1f ms max" % (name, count, mean * 1000, longest * 1000))
+    if own_window:
+        pygame.quit()
+    return next_step
+
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', help="Files")
+    parser.add_argument('--batch', '--export-only', action='store_true',
+                        help="Compute and export the data saved for the files, without opening a window")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of processes of the batch mode (default: number of processors)")
+    parser.add_argument('--detect-axes', action='store_true',
+                        help="Detect the axes of the images without saved session when they are opened")
+    parser.add_argument('--autosave-edits', type=int, default=50,
+                        help="Save the session in the background after this number of edits (default: 50)")
+    parser.add_argument('--autosave-seconds', type=float, default=30.0,
+                        help="Save the session in the background this long after an edit (default: 30)")
+    parser.add_argument('--profile', metavar='TRACE.json',
+                        help="Write the timings of the frames to a Chrome trace file")
+    parser.add_argument('--resample', metavar='START:STOP:COUNT',
+                        help="Export the series interpolated at COUNT values of X from START to STOP")
+    parser.add_argument('--log-grid', action='store_true',
+                        help="Space the values of --resample evenly in log10(X) and interpolate in log10(X)")
+    parser.add_argument('--output', metavar='FILE',
+                        help="Batch mode: also write the series of all the files in FILE, a .npz file or else a tab separated file")
+    parser.add_argument('--watch', metavar='DIRECTORY',
+                        help="Export the sessions of a directory again whenever their image, session or journal changes")
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help="Seconds between two scans of the watched directory (default: 2)")
+    parser.add_argument('--once', action='store_true',
+                        help="Scan the watched directory once and exit")
+    parser.add_argument('--snap', action='store_true',
+                        help="Start with the markers snapped on the features of the images (G toggles it)")
+    parser.add_argument('--startup-report', action='store_true',
+                        help="Print the time taken by each phase of the start until the first frame")
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help="Number of following images loaded in the background (default: 2)")
+    args = parser.parse_args()
+    print("files:", args.files)
+    filenames = [filename for filename in args.files]
+    grid = None
+    if args.resample:
+        start, stop, count = args.resample.split(":")
+        grid = make_grid(float(start), float(stop), int(count), args.log_grid)
+    if args.watch:
+        return watch_directory(args.watch, args.interval, args.workers, args.once, grid, args.log_grid)
+    if args.batch:
+        return 1 if run_batch(filenames, args.workers, grid=grid, log=args.log_grid, output=args.output) else 0
+    profiler = FrameProfiler(args.profile) if args.profile else None
+    startup = None
+    if args.startup_report:
+        startup = StartupReport()
+        startup.add("imports", START_TIME, time.perf_counter())
+    try:
+        analyze_pictures(filenames, args.detect_axes, args.autosave_edits, args.autosave_seconds, profiler, args.prefetch, args.snap,
+                         startup)
+    finally:
+        if profiler is not None:
+            profiler.write()
+    return 0
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('files', nargs='*', help="Files")
-args = parser.parse_args()
-print("files:", args.files)
-filenames = [filename for filename in args.files]
-for filename in filenames:
-    analyze_picture(filename)
+if __name__ == "__main__":
+    raise SystemExit(main())